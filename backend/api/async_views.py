@@ -0,0 +1,124 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections, connections
+from rest_framework.permissions import SAFE_METHODS
+
+
+def run_in_pool(view):
+    """
+    Выполняет представление в потоке пула со своим соединением с базой
+    и закрывает соединение после запроса, как это делает WSGI-сервер.
+    """
+
+    @wraps(view)
+    def handler(request, *args, **kwargs):
+        close_old_connections()
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(handler, thread_sensitive=False)
+
+
+def async_view(view):
+    """
+    Оборачивает представление DRF в асинхронное.
+
+    Django 3.2 не умеет асинхронно работать с ORM, а синхронные
+    представления под ASGI выполняет по очереди в одном потоке. Читающие
+    запросы поэтому выполняются в пуле потоков параллельно, а изменяющие -
+    как обычные синхронные представления.
+    """
+    read = run_in_pool(view)
+    write = sync_to_async(view)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return await read(request, *args, **kwargs)
+        return await write(request, *args, **kwargs)
+
+    return wrapper
+
+
+class AsyncReadViewMixin:
+    """
+    При ASYNC_VIEWS = True отдаёт вьюсет как асинхронное представление,
+    которое выполняет читающие запросы параллельно (см. async_view).
+    """
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not settings.ASYNC_VIEWS:
+            return view
+        return async_view(view)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    ASGI-обработчик, который читает тело потокового ответа по частям в
+    отдельном потоке, а не в цикле событий: части формируются запросами к
+    базе, а в цикле событий они запрещены. Все части одного ответа читаются
+    в одном потоке, потому что итератор по queryset привязан к соединению
+    потока, и ответ не собирается в памяти целиком.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": self.get_response_headers(response),
+        })
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1)
+        parts = iter(response)
+        try:
+            while True:
+                part = await loop.run_in_executor(executor, next, parts, None)
+                if part is None:
+                    break
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": True,
+                    })
+            await send({"type": "http.response.body"})
+        finally:
+            await loop.run_in_executor(executor, connections.close_all)
+            executor.shutdown(wait=False)
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+    def get_response_headers(self, response):
+        headers = [
+            (
+                header.encode("ascii") if isinstance(header, str) else header,
+                value.encode("latin1") if isinstance(value, str) else value,
+            )
+            for header, value in response.items()
+        ]
+        headers.extend(
+            (b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+            for cookie in response.cookies.values()
+        )
+        return headers
+
+
+def get_asgi_application():
+    """
+    Как django.core.asgi.get_asgi_application, но со
+    StreamingASGIHandler.
+    """
+    django.setup(set_prefix=False)
+    return StreamingASGIHandler()
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+User = get_user_model()
+
+KEY_TEMPLATE = "auth_token:{}"
+
+# Счётчики пользователя в кеш не попадают и остаются отложенными полями:
+# save() пользователя из кеша обновит только остальные поля и не затрёт
+# счётчики устаревшими значениями.
+SNAPSHOT_FIELDS = tuple(
+    field.attname
+    for field in User._meta.concrete_fields
+    if field.attname not in ("recipes_count", "followers_count")
+)
+
+
+class TokenCache:
+    """
+    Кеш соответствия токена и пользователя: LRU в памяти процесса с
+    коротким сроком жизни и, если включён, общий кеш Django.
+
+    Срок жизни записей в памяти процесса ограничивает время, за которое
+    до него доходит сброс токена, сделанный в другом процессе.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _key(token_key):
+        # Сами токены в ключах кеша не храним
+        return KEY_TEMPLATE.format(sha256(token_key.encode()).hexdigest())
+
+    def get(self, token_key):
+        key = self._key(token_key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, snapshot = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    return snapshot
+                del self._entries[key]
+        if not settings.TOKEN_CACHE_SHARED:
+            return None
+        snapshot = cache.get(key)
+        if snapshot is not None:
+            self._remember(key, snapshot)
+        return snapshot
+
+    def set(self, token_key, snapshot):
+        key = self._key(token_key)
+        if settings.TOKEN_CACHE_SHARED:
+            cache.set(key, snapshot, timeout=settings.TOKEN_CACHE_TIMEOUT)
+        self._remember(key, snapshot)
+
+    def delete(self, token_key):
+        key = self._key(token_key)
+        with self._lock:
+            self._entries.pop(key, None)
+        if settings.TOKEN_CACHE_SHARED:
+            cache.delete(key)
+
+    def _remember(self, key, snapshot):
+        expires = time.monotonic() + settings.TOKEN_CACHE_LOCAL_TIMEOUT
+        with self._lock:
+            self._entries[key] = (expires, snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_CACHE_LOCAL_SIZE:
+                self._entries.popitem(last=False)
+
+
+token_cache = TokenCache()
+
+
+def make_snapshot(user):
+    return tuple(getattr(user, field) for field in SNAPSHOT_FIELDS)
+
+
+def restore_user(snapshot):
+    return User.from_db(DEFAULT_DB_ALIAS, SNAPSHOT_FIELDS, snapshot)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication, который берёт пользователя по токену из кеша
+    вместо запроса Token + User на каждый запрос. Записи кеша сбрасываются
+    при удалении токена (выход), сохранении и удалении пользователя
+    (api.signals).
+    """
+
+    def authenticate_credentials(self, key):
+        snapshot = token_cache.get(key)
+        if snapshot is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, make_snapshot(user))
+            return user, token
+
+        user = restore_user(snapshot)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _("User inactive or deleted.")
+            )
+        return user, self.get_model()(key=key, user=user)
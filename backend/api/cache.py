@@ -0,0 +1,165 @@
+from hashlib import md5
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import (
+    http_date,
+    parse_http_date_safe,
+    quote_etag,
+    urlencode,
+)
+from rest_framework.renderers import JSONRenderer
+
+from .data_version import (
+    FAVORITES,
+    RECIPES,
+    get_data_version,
+    get_data_versions,
+    recipe_version_name,
+)
+
+
+def request_hash(request):
+    """
+    Хеш адреса и параметров запроса без учёта порядка параметров и их
+    значений и без пустых значений. Хост входит в хеш, потому что ссылки
+    пагинации в ответе абсолютные.
+    """
+    query = urlencode(
+        sorted(
+            (name, sorted(value for value in values if value))
+            for name, values in request.query_params.lists()
+        ),
+        doseq=True,
+    )
+    url = request.build_absolute_uri(request.path)
+    return md5(f"{url}?{query}".encode()).hexdigest()
+
+
+class ResponseCacheMixin:
+    """
+    Кеширует отрендеренные JSON-ответы под ключом get_cache_key.
+
+    Ответ отдаётся со строгим ETag и с Last-Modified, если его выставил
+    обработчик, и по If-None-Match или If-Modified-Since клиент получает
+    304 без тела.
+    """
+
+    cache_timeout = 60 * 60 * 24
+    vary_headers = ("Accept",)
+
+    def get_cache_key(self, request):
+        """
+        Возвращает ключ кеша или None, если ответ не кешируется.
+        """
+        raise NotImplementedError
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        key = None
+        if isinstance(renderer, JSONRenderer):
+            key = self.get_cache_key(request)
+        if key is None:
+            return handler(request, *args, **kwargs)
+
+        cached = cache.get(key)
+        if cached is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = renderer.render(
+                response.data,
+                request.accepted_media_type,
+                self.get_renderer_context(),
+            )
+            cached = (
+                content,
+                quote_etag(md5(content).hexdigest()),
+                parse_http_date_safe(response.get("Last-Modified")),
+            )
+            cache.set(key, cached, self.cache_timeout)
+
+        content, etag, last_modified = cached
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = HttpResponse(
+                content, content_type=request.accepted_media_type
+            )
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified)
+        patch_vary_headers(response, self.vary_headers)
+        return response
+
+
+class ReferenceDataCacheMixin(ResponseCacheMixin):
+    """
+    Кеширует ответы list и retrieve для справочных данных.
+
+    Ключ кеша включает версию данных data_version_name, поэтому при её смене
+    старые записи просто перестают читаться.
+    """
+
+    data_version_name = None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_cache_key(self, request):
+        version = get_data_version(self.data_version_name)
+        return (
+            f"response:{self.data_version_name}:{version}:"
+            f"{request_hash(request)}"
+        )
+
+
+class AnonymousRecipeCacheMixin(ResponseCacheMixin):
+    """
+    Кеширует ответы list и retrieve рецептов для неавторизованных
+    пользователей: для них ответ зависит только от параметров запроса.
+
+    Страница рецепта привязана к версии этого рецепта, списки - к общей
+    версии рецептов, а списки с сортировкой - ещё и к версии избранного,
+    которую меняет и пересчёт популярности (update_trending). Изменение
+    рецепта сбрасывает только его страницу и списки (api.signals).
+    """
+
+    cache_timeout = 60 * 10
+    vary_headers = ("Accept", "Authorization")
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().retrieve(request, *args, **kwargs)
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_cache_key(self, request):
+        if self.action == "retrieve":
+            pk = str(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+            if not pk.isdigit():
+                return None
+            names = [recipe_version_name(pk)]
+        else:
+            names = [RECIPES]
+            if "ordering" in request.query_params:
+                names.append(FAVORITES)
+        versions = ":".join(get_data_versions(names))
+        return f"response:recipes:{versions}:{request_hash(request)}"
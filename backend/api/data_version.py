@@ -0,0 +1,89 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.utils import timezone
+
+KEY_TEMPLATE = "data_version:{}"
+RECIPES_CHANGED_AT_KEY = "recipes:changed_at"
+
+TAGS = "tags"
+INGREDIENTS = "ingredients"
+RECIPE_INGREDIENTS = "recipe_ingredients"
+# Общая версия списков рецептов и отдельная - для сортировки по популярности
+RECIPES = "recipes"
+FAVORITES = "favorites"
+
+
+def recipe_version_name(pk):
+    """
+    Имя версии данных одного рецепта.
+    """
+    return f"recipe:{pk}"
+
+
+def user_version_name(pk):
+    """
+    Имя версии связей пользователя с рецептами и авторами: избранного,
+    списка покупок и подписок.
+    """
+    return f"user:{pk}"
+
+
+def get_data_version(name):
+    """
+    Возвращает текущую версию набора данных name. Версия хранится в общем
+    кеше, поэтому её смена видна всем процессам приложения.
+    """
+    key = KEY_TEMPLATE.format(name)
+    version = cache.get(key)
+    if version is None:
+        version = uuid4().hex
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_data_versions(names):
+    """
+    Возвращает версии нескольких наборов данных одним обращением к кешу.
+    """
+    keys = {KEY_TEMPLATE.format(name): name for name in names}
+    found = cache.get_many(keys)
+    return [
+        found.get(key) or get_data_version(name) for key, name in keys.items()
+    ]
+
+
+def bump_data_version(name):
+    """
+    Меняет версию набора данных name после изменения его записей.
+    """
+    cache.set(KEY_TEMPLATE.format(name), uuid4().hex, timeout=None)
+
+
+def bump_data_versions(names):
+    cache.set_many(
+        {KEY_TEMPLATE.format(name): uuid4().hex for name in names},
+        timeout=None,
+    )
+
+
+def bump_recipe_versions(recipe_ids):
+    """
+    Меняет общую версию рецептов и версии рецептов recipe_ids и запоминает
+    время изменения рецептов. Время записывается после версий: запрос между
+    ними отдаст новые данные со старой датой изменения, а не наоборот.
+    """
+    bump_data_versions(
+        [RECIPES, *map(recipe_version_name, set(recipe_ids))]
+    )
+    cache.set(RECIPES_CHANGED_AT_KEY, timezone.now(), timeout=None)
+
+
+def get_recipes_changed_at():
+    """
+    Время последнего изменения, добавления или удаления рецепта. Если оно
+    неизвестно (кеш очищен), считается, что рецепты изменены сейчас.
+    """
+    cache.add(RECIPES_CHANGED_AT_KEY, timezone.now(), timeout=None)
+    return cache.get(RECIPES_CHANGED_AT_KEY)
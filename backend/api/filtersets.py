@@ -1,28 +1,163 @@
-from django_filters import FilterSet, AllValuesMultipleFilter, CharFilter
+from django.db import connection
+from django.db.models import Count
+from django.db.models.expressions import RawSQL
+from django_filters import (
+    BaseInFilter,
+    CharFilter,
+    ChoiceFilter,
+    FilterSet,
+    NumberFilter,
+)
 from recipes import models
+from recipes.search import search_recipes
+
+from .recipe_ingredient_index import recipe_ingredient_index
+
+
+class NumberInFilter(BaseInFilter, NumberFilter):
+    pass
+
+
+def order_by_ids(queryset, ids):
+    """
+    Оставляет в queryset объекты ids в порядке ids. Позиции передаются в
+    базу таблицей VALUES, а не выражением CASE с веткой на каждый id.
+    """
+    if not ids:
+        return queryset.none()
+    meta = queryset.model._meta
+    column = ".".join(
+        map(connection.ops.quote_name, (meta.db_table, meta.pk.column))
+    )
+    values = ", ".join(["(%s, %s)"] * len(ids))
+    params = [
+        value for position, pk in enumerate(ids) for value in (pk, position)
+    ]
+    position = RawSQL(
+        f"SELECT positions.column2 FROM (VALUES {values}) AS positions "
+        f"WHERE positions.column1 = {column}",
+        params,
+    )
+    return queryset.filter(id__in=ids).order_by(position)
 
 
 class RecipeFilter(FilterSet):
-    tags = AllValuesMultipleFilter(field_name="tags__slug")
+    ORDERINGS = {
+        "favorites": ("-favorites_count", "-id"),
+        "trending": ("-trending_score", "-id"),
+    }
+    # Больше id рецептов, найденных по индексу, передаются в базу не
+    # списком параметров, а подзапросом к IngredientRecipe
+    ID_LIST_LIMIT = 1000
+
+    # AllValuesMultipleFilter выбирал все slug тегов из рецептов на каждый
+    # запрос, поэтому теги фильтруются методом по списку из query string
+    tags = CharFilter(method="filter_tags")
+    author = NumberFilter(field_name="author")
     is_favorited = CharFilter(method='filter_is_favorited')
     is_in_shopping_cart = CharFilter(method='filter_is_in_shopping_cart')
+    search = CharFilter(method="filter_search")
+    # Фильтры по ингредиентам считаются по инвертированному индексу, а не
+    # соединениями с IngredientRecipe на каждый ингредиент
+    ingredients = NumberInFilter(method="filter_ingredients")
+    exclude_ingredients = NumberInFilter(method="filter_exclude_ingredients")
+    match = ChoiceFilter(
+        choices=(
+            ("all", "Все ингредиенты"),
+            ("any", "Любой из ингредиентов"),
+        ),
+        method="filter_match",
+    )
+    ordering = ChoiceFilter(
+        choices=(
+            ("favorites", "Самые популярные"),
+            ("trending", "Популярные сейчас"),
+        ),
+        method="filter_ordering",
+    )
+
+    def filter_tags(self, queryset, name, value):
+        slugs = self.data.getlist(name)
+        return queryset.filter(tags__slug__in=slugs).distinct()
 
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
         if user.is_authenticated and value == "1":
-            queryset = queryset.filter(
-                favorite_recipe__user=user
-            )
+            queryset = queryset.filter(is_favorited=True)
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         user = self.request.user
         if user.is_authenticated and value == "1":
-            queryset = queryset.filter(
-                shopping_cart_recipe__user=user
+            queryset = queryset.filter(is_in_shopping_cart=True)
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        return search_recipes(queryset, value)
+
+    def get_ingredient_ids(self, name):
+        return [int(pk) for pk in self.form.cleaned_data.get(name) or ()]
+
+    def filter_ingredients(self, queryset, name, value):
+        ingredient_ids = set(self.get_ingredient_ids(name))
+        excluded_ids = set(self.get_ingredient_ids("exclude_ingredients"))
+        if self.form.cleaned_data.get("match") == "any":
+            # Рецепты упорядочены по тому, какая доля их ингредиентов есть
+            # среди переданных; отдаются не больше rank_limit лучших
+            excluded = recipe_ingredient_index.match_any(excluded_ids)
+            ids = recipe_ingredient_index.rank(
+                ingredient_ids, exclude=excluded
+            )
+            return order_by_ids(queryset, ids)
+        ids = recipe_ingredient_index.match_all(ingredient_ids)
+        if len(ids) > self.ID_LIST_LIMIT:
+            ids = (
+                models.IngredientRecipe.objects.filter(
+                    ingredient_id__in=ingredient_ids
+                )
+                .values("recipe_id")
+                .annotate(matched=Count("ingredient_id"))
+                .filter(matched=len(ingredient_ids))
+                .values("recipe_id")
             )
+        return self.exclude_recipes(queryset.filter(id__in=ids), excluded_ids)
+
+    def filter_exclude_ingredients(self, queryset, name, value):
+        if self.form.cleaned_data.get("ingredients"):
+            # Исключения уже учтены в filter_ingredients
+            return queryset
+        return self.exclude_recipes(
+            queryset, set(self.get_ingredient_ids(name))
+        )
+
+    def exclude_recipes(self, queryset, ingredient_ids):
+        ids = recipe_ingredient_index.match_any(ingredient_ids)
+        if len(ids) > self.ID_LIST_LIMIT:
+            ids = models.IngredientRecipe.objects.filter(
+                ingredient_id__in=ingredient_ids
+            ).values("recipe_id")
+        return queryset.exclude(id__in=ids)
+
+    def filter_match(self, queryset, name, value):
+        # Режим сопоставления применяется в filter_ingredients
         return queryset
 
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*self.ORDERINGS[value])
+
     class Meta:
         model = models.Recipe
-        fields = ("author", "tags", "is_favorited", "is_in_shopping_cart")
+        fields = (
+            "author",
+            "tags",
+            "is_favorited",
+            "is_in_shopping_cart",
+            "search",
+            "ingredients",
+            "exclude_ingredients",
+            "match",
+            "ordering",
+        )
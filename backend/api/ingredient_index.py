@@ -0,0 +1,78 @@
+import threading
+from bisect import bisect_left
+from operator import itemgetter
+
+from recipes.models import Ingredient
+
+from .data_version import INGREDIENTS, get_data_version
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов в памяти процесса для автодополнения по названию.
+
+    Названия хранятся отсортированным списком: совпадения по началу
+    названия ищутся бинарным поиском, совпадения по вхождению - проходом
+    по списку. Индекс перестраивается, когда меняется версия данных
+    ингредиентов.
+    """
+
+    search_limit = 50
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = ([], [])
+
+    def _build(self, version):
+        # Сортировка в Python, а не в базе: бинарный поиск сравнивает
+        # строки по кодовым точкам, а порядок сортировки PostgreSQL зависит
+        # от локали (пробелы и знаки препинания пропускаются, "ё" стоит
+        # рядом с "е")
+        rows = sorted(
+            Ingredient.objects.values_list("id", "name", "measurement_unit"),
+            key=itemgetter(1, 2),
+        )
+        items = [
+            {"id": pk, "name": name, "measurement_unit": measurement_unit}
+            for pk, name, measurement_unit in rows
+        ]
+        self._index = ([item["name"] for item in items], items)
+        self._version = version
+
+    def _get_index(self):
+        version = get_data_version(INGREDIENTS)
+        if self._version != version:
+            with self._lock:
+                if self._version != version:
+                    self._build(version)
+        return self._index
+
+    def all(self):
+        return self._get_index()[1]
+
+    def search(self, term, limit=None):
+        """
+        Возвращает сначала ингредиенты, название которых начинается с term,
+        затем те, в названии которых term встречается, не более limit.
+        """
+        names, items = self._get_index()
+        term = term.strip().lower()
+        limit = limit or self.search_limit
+        result = []
+
+        start = bisect_left(names, term)
+        for index in range(start, len(names)):
+            if len(result) >= limit or not names[index].startswith(term):
+                break
+            result.append(items[index])
+
+        for index, name in enumerate(names):
+            if len(result) >= limit:
+                break
+            if term in name and not name.startswith(term):
+                result.append(items[index])
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,287 @@
+import asyncio
+import base64
+import json
+import statistics
+import time
+from datetime import datetime
+from io import BytesIO
+
+from api.authentication import CachedTokenAuthentication
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import AsyncClient, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from recipes.models import Ingredient, Recipe, Tag
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+
+User = get_user_model()
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def make_image():
+    buffer = BytesIO()
+    Image.new("RGB", (64, 64), (200, 120, 40)).save(buffer, "PNG")
+    return "data:image/png;base64," + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет основные эндпоинты API тестовым клиентом Django на "
+        "текущей базе: p50/p95, число SQL-запросов и пропускную способность. "
+        "Изменения в базе, сделанные во время замеров, откатываются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument("--output", default=None)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help=(
+                "Число одновременных запросов. Больше 1 - читающие сценарии "
+                "выполняются через ASGI-обработчик."
+            ),
+        )
+        parser.add_argument(
+            "--only", nargs="*", default=None, help="Имена сценариев."
+        )
+
+    def handle(self, *args, **options):
+        user = (
+            User.objects.filter(shopping_cart_user__isnull=False)
+            .order_by("id")
+            .first()
+        )
+        recipe = Recipe.objects.order_by("id").first()
+        tag = Tag.objects.order_by("id").first()
+        ingredients = list(Ingredient.objects.values_list("id", flat=True)[:8])
+        if user is None or recipe is None or tag is None:
+            raise CommandError(
+                "Недостаточно данных: запустите manage.py generate_data."
+            )
+
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.token = token
+        own_recipe = user.recipes.order_by("id").first() or recipe
+        prefix = Ingredient.objects.values_list("name", flat=True).first()
+        payload = {
+            "ingredients": [{"id": pk, "amount": 10} for pk in ingredients],
+            "tags": [tag.id],
+            "image": make_image(),
+            "name": "Рецепт для замера",
+            "text": "Описание",
+            "cooking_time": 10,
+        }
+        scenarios = {
+            "recipes_list": ("get", "/api/recipes/", None),
+            "recipes_list_50": ("get", "/api/recipes/?limit=50", None),
+            "recipes_list_filtered": (
+                "get",
+                f"/api/recipes/?tags={tag.slug}&is_favorited=1",
+                None,
+            ),
+            "recipes_list_sparse": (
+                "get",
+                "/api/recipes/?limit=50&fields=id,name,image,cooking_time",
+                None,
+            ),
+            "recipes_list_cursor": (
+                "get", "/api/recipes/?pagination=cursor", None
+            ),
+            "recipe_detail": ("get", f"/api/recipes/{recipe.id}/", None),
+            "recipe_similar": (
+                "get", f"/api/recipes/{recipe.id}/similar/", None
+            ),
+            "subscriptions": (
+                "get", "/api/users/subscriptions/?recipes_limit=3", None
+            ),
+            "download_shopping_cart": (
+                "get", "/api/recipes/download_shopping_cart/", None
+            ),
+            "ingredient_search": (
+                "get", f"/api/ingredients/?name={prefix[:2]}", None
+            ),
+            "recipe_create": ("post", "/api/recipes/", payload),
+            "recipe_update": (
+                "patch", f"/api/recipes/{own_recipe.id}/", payload
+            ),
+        }
+        if options["only"]:
+            scenarios = {
+                name: scenario for name, scenario in scenarios.items()
+                if name in options["only"]
+            }
+
+        authentications = {
+            "authentication_stock": TokenAuthentication,
+            "authentication_cached": CachedTokenAuthentication,
+        }
+        if options["only"]:
+            authentications = {
+                name: authentication
+                for name, authentication in authentications.items()
+                if name in options["only"]
+            }
+
+        results = {}
+        for name, (method, url, data) in scenarios.items():
+            if options["concurrency"] > 1:
+                # Потоковый ответ под ASGI читается в цикле событий
+                if method != "get" or name == "download_shopping_cart":
+                    continue
+                results[name] = self.run_concurrent(
+                    url, options["iterations"], options["concurrency"]
+                )
+                continue
+            results[name] = self.run_scenario(
+                method, url, data, options["iterations"], options["warmup"]
+            )
+        for name, authentication in authentications.items():
+            results[name] = self.run_authentication(
+                authentication(),
+                token.key,
+                options["iterations"],
+                options["warmup"],
+            )
+        for name in results:
+            self.stdout.write(
+                f"{name:24} p50 {results[name]['p50_ms']:8.2f} ms  "
+                f"p95 {results[name]['p95_ms']:8.2f} ms  "
+                f"{results[name]['queries']:4} queries  "
+                f"{results[name]['rps']:8.1f} req/s"
+            )
+
+        report = {
+            "meta": {
+                "database": connection.vendor,
+                "iterations": options["iterations"],
+                "concurrency": options["concurrency"],
+                "async_views": settings.ASYNC_VIEWS,
+                "started": datetime.now().isoformat(timespec="seconds"),
+                "users": User.objects.count(),
+                "recipes": Recipe.objects.count(),
+            },
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    def request(self, method, url, data):
+        kwargs = {}
+        if data is not None:
+            kwargs = {"data": data, "content_type": "application/json"}
+        response = getattr(self.client, method)(url, **kwargs)
+        if response.streaming:
+            b"".join(response.streaming_content)
+        return response
+
+    def run_concurrent(self, url, iterations, concurrency):
+        """
+        Выполняет iterations GET-запросов через ASGI-обработчик, не более
+        concurrency одновременно. Пропускная способность считается по
+        общему времени, а не по сумме длительностей запросов.
+        """
+        client = AsyncClient()
+        authorization = f"Token {self.token.key}"
+        durations = []
+        queries = []
+        statuses = set()
+
+        async def send(semaphore):
+            async with semaphore:
+                started = time.perf_counter()
+                # Заголовки AsyncClient передаются именованными аргументами
+                response = await client.get(url, authorization=authorization)
+                durations.append(time.perf_counter() - started)
+                statuses.add(response.status_code)
+                performance = getattr(response, "performance", None)
+                if performance is not None:
+                    queries.append(performance.queries)
+
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+            await asyncio.gather(*(send(semaphore) for _ in range(iterations)))
+
+        started = time.perf_counter()
+        asyncio.run(run())
+        elapsed = time.perf_counter() - started
+        return {
+            "method": "GET",
+            "url": url,
+            "status": sorted(statuses),
+            "p50_ms": round(statistics.median(durations) * 1000, 2),
+            "p95_ms": round(percentile(durations, 95) * 1000, 2),
+            "mean_ms": round(statistics.mean(durations) * 1000, 2),
+            "queries": max(queries) if queries else None,
+            "rps": round(len(durations) / elapsed, 1),
+        }
+
+    def run_authentication(self, authentication, key, iterations, warmup):
+        """
+        Замеряет только аутентификацию запроса по токену, без представления.
+        """
+        factory = RequestFactory()
+        durations = []
+        queries = []
+        for iteration in range(warmup + iterations):
+            request = Request(
+                factory.get("/api/", HTTP_AUTHORIZATION=f"Token {key}")
+            )
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                authentication.authenticate(request)
+                duration = time.perf_counter() - started
+            if iteration >= warmup:
+                durations.append(duration)
+                queries.append(len(context.captured_queries))
+        return {
+            "class": type(authentication).__name__,
+            "p50_ms": round(statistics.median(durations) * 1000, 3),
+            "p95_ms": round(percentile(durations, 95) * 1000, 3),
+            "mean_ms": round(statistics.mean(durations) * 1000, 3),
+            "queries": max(queries),
+            "rps": round(len(durations) / sum(durations), 1),
+        }
+
+    def run_scenario(self, method, url, data, iterations, warmup):
+        durations = []
+        queries = []
+        statuses = set()
+        with transaction.atomic():
+            for _ in range(warmup):
+                self.request(method, url, data)
+            for _ in range(iterations):
+                started = time.perf_counter()
+                response = self.request(method, url, data)
+                durations.append(time.perf_counter() - started)
+                statuses.add(response.status_code)
+                performance = getattr(response, "performance", None)
+                if performance is not None:
+                    queries.append(performance.queries)
+            transaction.set_rollback(True)
+        return {
+            "method": method.upper(),
+            "url": url,
+            "status": sorted(statuses),
+            "p50_ms": round(statistics.median(durations) * 1000, 2),
+            "p95_ms": round(percentile(durations, 95) * 1000, 2),
+            "mean_ms": round(statistics.mean(durations) * 1000, 2),
+            "queries": max(queries) if queries else None,
+            "rps": round(len(durations) / sum(durations), 1),
+        }
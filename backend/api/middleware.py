@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+from collections import Counter
+from contextvars import ContextVar
+from hashlib import md5
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger("api.performance")
+
+# Метрики текущего запроса. Контекст копируется в потоки, в которых
+# выполняются представления при работе через ASGI, поэтому запросы к базе
+# учитываются независимо от того, в каком потоке они сделаны.
+current_metrics = ContextVar("current_metrics", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RequestMetrics:
+    """
+    Собирает SQL-запросы и время обработки одного запроса. Передаётся в
+    connection.execute_wrapper и вызывается для каждого запроса к базе.
+    """
+
+    def __init__(self, method):
+        self.method = method
+        self.view_name = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+        self.samples = {}
+        self.app_time = 0.0
+        self.render_time = 0.0
+        self.total_time = 0.0
+        self._view_started = None
+        self._view_finished = None
+        self._view_db_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.queries += 1
+            fingerprint = md5(" ".join(sql.split()).encode()).hexdigest()[:12]
+            self.fingerprints[fingerprint] += 1
+            self.samples.setdefault(fingerprint, sql)
+
+    def start_view(self, view_name):
+        self.view_name = view_name
+        self._view_started = perf_counter()
+        self._view_db_time = self.db_time
+
+    def finish_view(self):
+        if self._view_started is not None:
+            self._view_finished = perf_counter()
+            elapsed = self._view_finished - self._view_started
+            self.app_time = elapsed - (self.db_time - self._view_db_time)
+
+    def finish(self, started):
+        finished = perf_counter()
+        self.total_time = finished - started
+        if self._view_finished is not None:
+            self.render_time = finished - self._view_finished
+        elif self._view_started is not None:
+            # Ответ без отложенного рендеринга: всё время - в представлении
+            self.finish_view()
+
+    @property
+    def duplicates(self):
+        return {
+            fingerprint: count
+            for fingerprint, count in self.fingerprints.most_common()
+            if count > 1
+        }
+
+    @property
+    def budget_key(self):
+        return f"{self.method} {self.view_name}"
+
+    @property
+    def budget(self):
+        return getattr(settings, "QUERY_BUDGETS", {}).get(self.budget_key)
+
+    def server_timing(self):
+        return ", ".join((
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f"app;dur={self.app_time * 1000:.1f}",
+            f"render;dur={self.render_time * 1000:.1f}",
+            f"total;dur={self.total_time * 1000:.1f}",
+        ))
+
+    def as_dict(self):
+        return {
+            "view": self.budget_key,
+            "queries": self.queries,
+            "budget": self.budget,
+            "duplicates": {
+                fingerprint: {
+                    "count": count,
+                    "sql": self.samples[fingerprint][:200],
+                }
+                for fingerprint, count in self.duplicates.items()
+            },
+            "db_ms": round(self.db_time * 1000, 1),
+            "app_ms": round(self.app_time * 1000, 1),
+            "render_ms": round(self.render_time * 1000, 1),
+            "total_ms": round(self.total_time * 1000, 1),
+        }
+
+
+class MeasuredStream:
+    """
+    Итератор по телу потокового ответа: учитывает в metrics запросы к базе,
+    сделанные при формировании каждой части, в каком бы потоке и контексте
+    сервер ни читал тело. on_close вызывается один раз, когда сервер
+    закрывает ответ.
+    """
+
+    def __init__(self, content, metrics, on_close):
+        self.content = iter(content)
+        self.metrics = metrics
+        self.on_close = on_close
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = current_metrics.set(self.metrics)
+        try:
+            return next(self.content)
+        finally:
+            current_metrics.reset(token)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.on_close()
+
+
+class PerformanceMiddleware:
+    """
+    Считает SQL-запросы, повторяющиеся запросы, время в базе, время
+    приложения (время представления за вычетом времени в базе: разбор
+    запроса, фильтрация, сериализация и остальной код представления), время
+    рендеринга ответа и общее время.
+
+    Метрики пишутся в лог api.performance, а при SERVER_TIMING = True
+    отдаются в заголовке Server-Timing. Запросы сверх бюджета из
+    QUERY_BUDGETS пишутся в лог с уровнем WARNING.
+
+    Тело потокового ответа формируется уже после выхода из middleware,
+    поэтому его запросы досчитываются при отправке, а метрики пишутся в лог
+    после закрытия ответа. Server-Timing такого ответа уходит вместе с
+    заголовками и учитывает только работу представления.
+
+    Работает и в синхронной, и в асинхронной цепочке middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        # Соединения, открытые до подключения обработчика connection_created
+        for connection in connections.all():
+            install_query_recorder(None, connection)
+        metrics, token, started = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(metrics, started, response)
+
+    async def __acall__(self, request):
+        metrics, token, started = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(metrics, started, response)
+
+    def start(self, request):
+        metrics = request.performance = RequestMetrics(request.method)
+        return metrics, current_metrics.set(metrics), perf_counter()
+
+    def finish(self, metrics, started, response):
+        metrics.finish(started)
+        response.performance = metrics
+        if getattr(settings, "SERVER_TIMING", False):
+            response["Server-Timing"] = metrics.server_timing()
+        if response.streaming:
+            response.streaming_content = MeasuredStream(
+                response.streaming_content,
+                metrics,
+                lambda: self.finish_stream(metrics, started),
+            )
+        else:
+            self.log(metrics)
+        return response
+
+    def finish_stream(self, metrics, started):
+        metrics.finish(started)
+        self.log(metrics)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.performance.start_view(request.resolver_match.view_name)
+
+    def process_template_response(self, request, response):
+        request.performance.finish_view()
+        return response
+
+    def log(self, metrics):
+        budget = metrics.budget
+        over_budget = budget is not None and metrics.queries > budget
+        level = logging.WARNING if over_budget else logging.INFO
+        if logger.isEnabledFor(level):
+            record = json.dumps(metrics.as_dict(), ensure_ascii=False)
+            logger.log(level, record)
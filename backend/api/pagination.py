@@ -1,6 +1,45 @@
-from rest_framework.pagination import PageNumberPagination
+from django.db import connections
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class PageNumberLimitPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = "limit"
+
+
+class CursorLimitPagination(CursorPagination):
+    """
+    Пагинация по ключу: следующая страница выбирается условием id < курсора,
+    поэтому глубокие страницы стоят столько же, сколько первая.
+
+    Общее число объектов не считается; с параметром count=approx в ответ
+    добавляется оценка числа строк из плана запроса PostgreSQL.
+    """
+
+    page_size = 6
+    page_size_query_param = "limit"
+    ordering = "-id"
+    count_query_param = "count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) == "approx":
+            self.count = self.get_approximate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_approximate_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return queryset.count()
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        return plan[0]["Plan"]["Plan Rows"]
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data["count"] = self.count
+            response.data.move_to_end("count", last=False)
+        return response
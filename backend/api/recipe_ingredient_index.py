@@ -0,0 +1,200 @@
+import heapq
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from recipes.models import IngredientRecipe
+
+from .data_version import RECIPE_INGREDIENTS, get_data_version
+
+SEQUENCE_KEY = "recipe_ingredients:{}:sequence"
+CHANGE_KEY = "recipe_ingredients:{}:change:{}"
+
+
+class RecipeIngredientIndex:
+    """
+    Инвертированный индекс в памяти процесса: для каждого ингредиента -
+    множество id рецептов, в которые он входит, и состав каждого рецепта.
+
+    Фильтры по ингредиентам и ранжирование по запасам пользователя
+    считаются по индексу без соединений с таблицей ингредиентов рецептов.
+
+    Изменения состава рецептов записываются в журнал в общем кеше
+    (publish), и каждый процесс применяет новые записи журнала к своему
+    индексу при следующем обращении. Целиком индекс перестраивается только
+    при смене версии состава рецептов (массовая загрузка данных, удаление
+    ингредиента), при пропуске записей журнала или отставании больше
+    log_size записей.
+
+    Множества в индексе не меняются на месте, а заменяются новыми, поэтому
+    запросы из других потоков могут читать индекс без блокировки.
+    """
+
+    rank_limit = 1000
+    chunk_size = 10000
+    log_size = 1000
+    log_timeout = 60 * 60
+    # Сколько ждать запись журнала, номер которой уже выдан, но которая ещё
+    # не записана, прежде чем перестроить индекс целиком
+    log_wait = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._sequence = 0
+        self._gap = None
+        self._postings = {}
+        self._recipes = {}
+
+    def _build(self, version, sequence):
+        postings = defaultdict(set)
+        recipes = defaultdict(set)
+        rows = (
+            IngredientRecipe.objects.order_by("ingredient_id", "recipe_id")
+            .values_list("ingredient_id", "recipe_id")
+            .iterator(chunk_size=self.chunk_size)
+        )
+        for ingredient_id, recipe_id in rows:
+            postings[ingredient_id].add(recipe_id)
+            recipes[recipe_id].add(ingredient_id)
+        self._postings = dict(postings)
+        self._recipes = {
+            recipe_id: frozenset(ingredient_ids)
+            for recipe_id, ingredient_ids in recipes.items()
+        }
+        self._version = version
+        self._sequence = sequence
+        self._gap = None
+
+    def _apply(self, recipe_id, ingredient_ids):
+        old = self._recipes.get(recipe_id, frozenset())
+        new = frozenset(ingredient_ids or ())
+        if new:
+            self._recipes[recipe_id] = new
+        for pk in new - old:
+            self._postings[pk] = self._postings.get(pk, set()) | {recipe_id}
+        for pk in old - new:
+            posting = self._postings.get(pk, set()) - {recipe_id}
+            if posting:
+                self._postings[pk] = posting
+            else:
+                self._postings.pop(pk, None)
+        if not new:
+            self._recipes.pop(recipe_id, None)
+
+    def _catch_up(self, version, sequence):
+        """
+        Применяет записи журнала после self._sequence до sequence.
+        Возвращает False, если индекс нужно перестроить целиком.
+        """
+        if not 0 <= sequence - self._sequence <= self.log_size:
+            # Журнал отстал больше чем на log_size записей или начат заново
+            # после очистки кеша
+            return False
+        numbers = range(self._sequence + 1, sequence + 1)
+        changes = cache.get_many(
+            [CHANGE_KEY.format(version, number) for number in numbers]
+        )
+        for number in numbers:
+            change = changes.get(CHANGE_KEY.format(version, number))
+            if change is None:
+                # Номер выдан, но запись ещё не сделана - или уже вытеснена
+                now = time.monotonic()
+                if self._gap is None or self._gap[0] != number:
+                    self._gap = (number, now)
+                return now - self._gap[1] < self.log_wait
+            self._apply(*change)
+            self._sequence = number
+        self._gap = None
+        return True
+
+    def _get_index(self):
+        version = get_data_version(RECIPE_INGREDIENTS)
+        sequence = cache.get(SEQUENCE_KEY.format(version), 0)
+        if self._version != version or self._sequence != sequence:
+            with self._lock:
+                if self._version != version or not self._catch_up(
+                    version, sequence
+                ):
+                    # Номер журнала читается до чтения таблицы: изменения,
+                    # сделанные во время перестройки, применятся повторно
+                    self._build(version, sequence)
+        return self._postings, self._recipes
+
+    def publish(self, recipe_id, ingredient_ids):
+        """
+        Записывает в журнал новый состав рецепта (None - рецепт удалён).
+        Вызывается после фиксации транзакции.
+        """
+        version = get_data_version(RECIPE_INGREDIENTS)
+        key = SEQUENCE_KEY.format(version)
+        cache.add(key, 0, timeout=None)
+        sequence = cache.incr(key)
+        if ingredient_ids is not None:
+            ingredient_ids = tuple(ingredient_ids)
+        cache.set(
+            CHANGE_KEY.format(version, sequence),
+            (recipe_id, ingredient_ids),
+            timeout=self.log_timeout,
+        )
+
+    def match_all(self, ingredient_ids):
+        """
+        Возвращает множество id рецептов, содержащих все ингредиенты.
+        """
+        postings, _ = self._get_index()
+        lists = sorted(
+            (postings.get(pk, ()) for pk in set(ingredient_ids)), key=len
+        )
+        if not lists:
+            return set()
+        # Пересечение начинаем с самого короткого списка
+        result = set(lists[0])
+        for posting in lists[1:]:
+            if not result:
+                break
+            result.intersection_update(posting)
+        return result
+
+    def match_any(self, ingredient_ids):
+        """
+        Возвращает множество id рецептов, содержащих хотя бы один
+        из ингредиентов.
+        """
+        postings, _ = self._get_index()
+        result = set()
+        for pk in set(ingredient_ids):
+            result.update(postings.get(pk, ()))
+        return result
+
+    def rank(self, ingredient_ids, limit=None, exclude=()):
+        """
+        Возвращает id рецептов, упорядоченные по доле их ингредиентов,
+        которая есть среди ingredient_ids: первыми идут рецепты, которые
+        можно приготовить целиком, при равной доле - с большим числом
+        совпавших ингредиентов и более новые. Рецепты exclude пропускаются.
+
+        Возвращается не больше limit (по умолчанию rank_limit) рецептов:
+        остальные отсекаются до обращения к базе.
+        """
+        postings, recipes = self._get_index()
+        matched = Counter()
+        for pk in set(ingredient_ids):
+            matched.update(postings.get(pk, ()))
+        for recipe_id in exclude:
+            matched.pop(recipe_id, None)
+
+        def key(item):
+            recipe_id, count = item
+            # Рецепт мог быть удалён из индекса другим потоком
+            size = len(recipes.get(recipe_id, ())) or count
+            return count / size, count, recipe_id
+
+        top = heapq.nlargest(
+            limit or self.rank_limit, matched.items(), key=key
+        )
+        return [recipe_id for recipe_id, _ in top]
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
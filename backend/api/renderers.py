@@ -0,0 +1,35 @@
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson: сериализует списки рецептов в несколько раз
+    быстрее стандартного json. Включается в REST_FRAMEWORK
+    (DEFAULT_RENDERER_CLASSES) вместо JSONRenderer.
+
+    Типы, которые orjson не знает (Decimal, ленивые строки переводов),
+    кодируются так же, как в JSONRenderer.
+    """
+
+    def __init__(self):
+        if orjson is None:
+            raise ImproperlyConfigured(
+                "Для ORJSONRenderer нужно установить пакет orjson."
+            )
+        self.default = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        option = orjson.OPT_NON_STR_KEYS
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=self.default, option=option)
@@ -1,18 +1,117 @@
+from collections import Counter
+from operator import attrgetter
+
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils.functional import cached_property
 from djoser.serializers import UserCreateSerializer
 from drf_extra_fields.fields import Base64ImageField
-from recipes import models
+from recipes import models, shopping_list
+from recipes.images import VARIANTS, variant_name
+from recipes.signals import recipe_ingredients_saved
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.serializers import (
+    IntegerField,
+    ListField,
+    ListSerializer,
     ModelSerializer,
-    PrimaryKeyRelatedField,
     SerializerMethodField,
     ReadOnlyField,
+    Serializer,
+    ValidationError,
 )
 
 User = get_user_model()
 
 
+def resolve_ids(model, ids):
+    """
+    Загружает объекты model по списку ids одним запросом. Повторяющиеся
+    и несуществующие id перечисляются в одной ошибке валидации.
+    """
+    duplicates = sorted(pk for pk, count in Counter(ids).items() if count > 1)
+    if duplicates:
+        raise ValidationError(
+            f"Повторяющиеся id: {', '.join(map(str, duplicates))}."
+        )
+    objects = model.objects.in_bulk(ids)
+    missing = [pk for pk in ids if pk not in objects]
+    if missing:
+        raise ValidationError(
+            f"{model._meta.verbose_name_plural} с такими id не существуют: "
+            f"{', '.join(map(str, missing))}."
+        )
+    return objects
+
+
+def get_image_variants(recipe, request):
+    """
+    Возвращает ссылки на уменьшенные копии картинки рецепта. Пока копия
+    не готова, вместо неё отдаётся оригинал.
+    """
+    if not recipe.image:
+        return None
+    variants = {}
+    for variant in VARIANTS:
+        name = variant_name(recipe.image.name, variant)
+        if recipe.image_variants.get(variant) == name:
+            url = default_storage.url(name)
+        else:
+            url = recipe.image.url
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        variants[variant] = url
+    return variants
+
+
+class SparseFieldsetMixin:
+    """
+    Оставляет в ответе только поля из параметра fields и убирает поля из
+    параметра omit (имена через запятую). Действует на читающие запросы
+    и только на сериализатор верхнего уровня, а не на вложенные.
+
+    Вьюсеты по select_fields убирают из queryset подгрузку и аннотации
+    для полей, которых нет в ответе.
+    """
+
+    @classmethod
+    def select_fields(cls, request):
+        fields = cls.Meta.fields
+        if request is None or request.method not in SAFE_METHODS:
+            return fields
+        requested = {
+            param: {
+                name.strip()
+                for name in request.query_params.get(param, "").split(",")
+                if name.strip()
+            }
+            for param in ("fields", "omit")
+        }
+        unknown = (requested["fields"] | requested["omit"]) - set(fields)
+        if unknown:
+            raise ValidationError(
+                {"fields": f"Неизвестные поля: {', '.join(sorted(unknown))}."}
+            )
+        return tuple(
+            name
+            for name in fields
+            if (not requested["fields"] or name in requested["fields"])
+            and name not in requested["omit"]
+        )
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return fields
+        selected = self.select_fields(self.context.get("request"))
+        return {name: fields[name] for name in selected}
+
+
 class UserCreateSerializer(UserCreateSerializer):
     class Meta:
         model = User
@@ -42,6 +141,8 @@ class UserSerializer(ModelSerializer):
 
     def get_is_subscribed(self, obj):
         if self._context.get("request")._auth:
+            if hasattr(obj, "is_subscribed"):
+                return obj.is_subscribed
             user = self._context.get("request").user
             return obj.following.filter(user=user).exists()
         return "false"
@@ -71,21 +172,21 @@ class IngredientReedRecipeSerializer(ModelSerializer):
 
 
 class IngredientRecipeSerializer(IngredientReedRecipeSerializer):
-    id = PrimaryKeyRelatedField(
-        queryset=models.Ingredient.objects.all(), source="ingredient"
-    )
+    # Ингредиенты по id разрешаются разом в RecipeSerializer
+    id = IntegerField(min_value=1, source="ingredient")
 
     def to_representation(self, instance):
         return IngredientReedRecipeSerializer(instance).data
 
 
-class RecipeReadSerializer(ModelSerializer):
+class RecipeReadSerializer(SparseFieldsetMixin, ModelSerializer):
     author = SerializerMethodField(read_only=True)
     tags = TagSerializer(many=True)
-    ingredients = IngredientRecipeSerializer(many=True)
+    ingredients = IngredientReedRecipeSerializer(many=True)
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
     image = Base64ImageField()
+    images = SerializerMethodField()
 
     class Meta:
         model = models.Recipe
@@ -98,35 +199,89 @@ class RecipeReadSerializer(ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "images",
             "text",
             "cooking_time",
         )
 
     def get_is_favorited(self, obj):
         if self._context.get("request")._auth:
+            if hasattr(obj, "is_favorited"):
+                return obj.is_favorited
             user = self._context.get("request").user
             return obj.favorite_recipe.filter(user=user).exists()
         return "false"
 
     def get_is_in_shopping_cart(self, obj):
         if self._context.get("request")._auth:
+            if hasattr(obj, "is_in_shopping_cart"):
+                return obj.is_in_shopping_cart
             user = self._context.get("request").user
             return obj.shopping_cart_recipe.filter(user=user).exists()
         return "false"
 
+    def get_images(self, obj):
+        return get_image_variants(obj, self.context.get("request"))
+
+    @cached_property
+    def author_serializer(self):
+        # Один сериализатор на все рецепты списка: создание сериализатора
+        # на каждую строку заметно дороже самой сериализации
+        return UserSerializer(context=self.context)
+
     def get_author(self, obj):
-        return UserSerializer(context=self.context).to_representation(
-            obj.author
-        )
+        author = obj.author
+        # Подписка на автора аннотирована в RecipesViewSet.get_queryset
+        if hasattr(obj, "author_is_subscribed"):
+            author.is_subscribed = obj.author_is_subscribed
+        return self.author_serializer.to_representation(author)
 
 
 class RecipeSerializer(RecipeReadSerializer):
-    tags = PrimaryKeyRelatedField(
-        queryset=models.Tag.objects.all(),
-        many=True
-    )
+    tags = ListField(child=IntegerField(min_value=1))
+    ingredients = IngredientRecipeSerializer(many=True)
+
+    def validate_tags(self, value):
+        tags = resolve_ids(models.Tag, value)
+        return [tags[pk] for pk in value]
+
+    def validate_ingredients(self, value):
+        ingredients = resolve_ids(
+            models.Ingredient, [item["ingredient"] for item in value]
+        )
+        for item in value:
+            item["ingredient"] = ingredients[item["ingredient"]]
+        return value
+
+    @staticmethod
+    def cache_related(recipe, tags, recipe_ingredients):
+        """
+        Кладёт записанные теги и ингредиенты рецепта в кеш prefetch, как это
+        делает prefetch_related: ответ на запись не перечитывает их из базы.
+        """
+        recipe._prefetched_objects_cache = {}
+        for name, objects in (
+            ("tags", sorted(tags, key=attrgetter("id"))),
+            ("ingredients", recipe_ingredients),
+        ):
+            queryset = getattr(recipe, name).all()
+            queryset._result_cache = list(objects)
+            queryset._prefetch_done = True
+            recipe._prefetched_objects_cache[name] = queryset
 
     def to_representation(self, instance):
+        # После create и update теги и ингредиенты уже в кеше prefetch
+        # (cache_related), и prefetch_related_objects их не читает
+        prefetch_related_objects(
+            [instance],
+            "tags",
+            Prefetch(
+                "ingredients",
+                queryset=models.IngredientRecipe.objects.select_related(
+                    "ingredient"
+                ),
+            ),
+        )
         return RecipeReadSerializer(instance, context=self._context).data
 
     @transaction.atomic
@@ -152,6 +307,16 @@ class RecipeSerializer(RecipeReadSerializer):
             )
             recipes_ingredients_list.append(recipes_ingredient)
         recipe.ingredients.bulk_create(recipes_ingredients_list)
+        self.cache_related(recipe, tags, recipes_ingredients_list)
+        # Новый рецепт ещё никто не добавил в избранное и список покупок
+        recipe.is_favorited = recipe.is_in_shopping_cart = False
+        recipe_ingredients_saved.send(
+            sender=models.Recipe,
+            recipe_id=recipe.id,
+            ingredient_ids=[
+                item.ingredient_id for item in recipes_ingredients_list
+            ],
+        )
         return recipe
 
     @transaction.atomic
@@ -160,50 +325,56 @@ class RecipeSerializer(RecipeReadSerializer):
         ingredients = validated_data.pop("ingredients")
         recipe = super().update(instance, validated_data)
 
-        old_tags = recipe.tags.all()
-        # Удаляем ненужные больше теги
-        tags_for_delete = []
-        for tag in old_tags:
-            if tag not in tags:
-                tags_for_delete.append(tag)
-        if tags_for_delete:
-            recipe.tag_recipe.filter(tag__in=tags_for_delete).delete()
-
-        # Добавляем новые теги
-        recipes_tags_for_create = []
-        for tag in tags:
-            if tag not in old_tags:
-                recipes_tag = models.TagRecipe(tag=tag, recipe=recipe)
-                recipes_tags_for_create.append(recipes_tag)
-        if recipes_tags_for_create:
-            recipe.tag_recipe.bulk_create(recipes_tags_for_create)
+        # Текущие теги и ингредиенты читаются один раз (или берутся из
+        # prefetch) и сравниваются со словарями новых значений по id.
+        old_tag_ids = {tag.id for tag in recipe.tags.all()}
+        new_tag_ids = {tag.id for tag in tags}
+        tag_ids_for_delete = old_tag_ids - new_tag_ids
+        if tag_ids_for_delete:
+            # Связи удаляются одним DELETE, без выборки строк для сигналов:
+            # кеш рецепта сбрасывает сохранение самого рецепта
+            tag_recipes = recipe.tag_recipe.filter(
+                tag_id__in=tag_ids_for_delete
+            )
+            tag_recipes._raw_delete(tag_recipes.db)
+        tag_ids_for_create = new_tag_ids - old_tag_ids
+        if tag_ids_for_create:
+            recipe.tag_recipe.bulk_create(
+                models.TagRecipe(tag_id=tag_id, recipe=recipe)
+                for tag_id in tag_ids_for_create
+            )
 
-        old_recipes_ingredients = recipe.ingredients.all()
+        old_recipes_ingredients = {
+            recipes_ing.ingredient_id: recipes_ing
+            for recipes_ing in recipe.ingredients.all()
+        }
+        old_amounts = {
+            ingredient_id: recipes_ing.amount
+            for ingredient_id, recipes_ing in old_recipes_ingredients.items()
+        }
+        new_ingredients = {
+            ingredient["ingredient"].id: ingredient["ingredient"]
+            for ingredient in ingredients
+        }
+        new_amounts = {
+            ingredient["ingredient"].id: ingredient["amount"]
+            for ingredient in ingredients
+        }
         recipes_ingredients_for_create = []
         recipes_ingredients_for_update = []
-        new_ingredients_list = []
-        ingredients_for_delete = []
-
-        for ingredient in ingredients:
-            amount = ingredient.get("amount")
-            ing = ingredient.get("ingredient")
-            recipes_ing = models.IngredientRecipe(
-                ingredient=ing,
-                amount=amount,
-                recipe=recipe
-            )
-            new_ingredients_list.append(recipes_ing.ingredient)
-
-            qs_old_recipes_ing = old_recipes_ingredients.filter(
-                ingredient=ing
-            )
-            if not qs_old_recipes_ing.exists():
-                recipes_ingredients_for_create.append(recipes_ing)
-            else:
-                old_recipes_ing = qs_old_recipes_ing.get()
-                if old_recipes_ing.amount != amount:
-                    old_recipes_ing.amount = amount
-                    recipes_ingredients_for_update.append(old_recipes_ing)
+        for ingredient_id, amount in new_amounts.items():
+            recipes_ing = old_recipes_ingredients.get(ingredient_id)
+            if recipes_ing is None:
+                recipes_ingredients_for_create.append(
+                    models.IngredientRecipe(
+                        ingredient=new_ingredients[ingredient_id],
+                        amount=amount,
+                        recipe=recipe,
+                    )
+                )
+            elif recipes_ing.amount != amount:
+                recipes_ing.amount = amount
+                recipes_ingredients_for_update.append(recipes_ing)
 
         if recipes_ingredients_for_create:
             recipe.ingredients.bulk_create(recipes_ingredients_for_create)
@@ -212,14 +383,31 @@ class RecipeSerializer(RecipeReadSerializer):
                 recipes_ingredients_for_update,
                 ['amount']
             )
-
-        for recipes_ing in old_recipes_ingredients:
-            if recipes_ing.ingredient not in new_ingredients_list:
-                ingredients_for_delete.append(recipes_ing.ingredient)
-        if ingredients_for_delete:
-            recipe.ingredients.filter(
-                ingredient__in=ingredients_for_delete
-            ).delete()
+        ingredient_ids_for_delete = (
+            old_recipes_ingredients.keys() - new_amounts.keys()
+        )
+        if ingredient_ids_for_delete:
+            recipe_ingredients = recipe.ingredients.filter(
+                ingredient_id__in=ingredient_ids_for_delete
+            )
+            recipe_ingredients._raw_delete(recipe_ingredients.db)
+        shopping_list.change_recipe(
+            recipe.id, shopping_list.amount_deltas(old_amounts, new_amounts)
+        )
+        if old_amounts.keys() != new_amounts.keys():
+            recipe_ingredients_saved.send(
+                sender=models.Recipe,
+                recipe_id=recipe.id,
+                ingredient_ids=list(new_amounts),
+            )
+        recipes_ingredients = [
+            recipes_ing
+            for ingredient_id, recipes_ing in old_recipes_ingredients.items()
+            if ingredient_id in new_amounts
+        ]
+        self.cache_related(
+            recipe, tags, recipes_ingredients + recipes_ingredients_for_create
+        )
         return recipe
 
 
@@ -229,15 +417,25 @@ class FavoriteSerializer(RecipeReadSerializer):
         fields = ()
 
 
+class ShoppingListItemSerializer(IngredientReedRecipeSerializer):
+    class Meta:
+        model = models.ShoppingListItem
+        fields = ("id", "name", "measurement_unit", "amount")
+
+
 class CutawaySerializer(ModelSerializer):
+    images = SerializerMethodField()
+
     class Meta:
         model = models.Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "images", "cooking_time")
+
+    def get_images(self, obj):
+        return get_image_variants(obj, self.context.get("request"))
 
 
-class UserSubscribeSerializer(UserSerializer):
+class UserSubscribeSerializer(SparseFieldsetMixin, UserSerializer):
     recipes = CutawaySerializer(many=True)
-    recipes_count = SerializerMethodField()
 
     class Meta:
         model = User
@@ -252,5 +450,8 @@ class UserSubscribeSerializer(UserSerializer):
             "recipes_count",
         )
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+
+class BulkIdsSerializer(Serializer):
+    ids = ListField(
+        child=IntegerField(min_value=1), allow_empty=False, max_length=100
+    )
@@ -0,0 +1,73 @@
+import csv
+import json
+
+from recipes import models
+
+CHUNK_SIZE = 2000
+
+
+def get_shopping_list(user):
+    """
+    Строки списка покупок пользователя. Суммы хранятся в ShoppingListItem и
+    обновляются при изменении списка (recipes.shopping_list), поэтому
+    список читается по индексу без GROUP BY по ингредиентам рецептов.
+    """
+    return models.ShoppingListItem.objects.filter(
+        user=user, recipes_count__gt=0
+    ).order_by("ingredient__name", "ingredient__measurement_unit")
+
+
+def get_shopping_cart(user):
+    """
+    Возвращает суммарное количество каждого ингредиента из списка покупок
+    пользователя.
+    """
+    return get_shopping_list(user).values_list(
+        "ingredient__name", "ingredient__measurement_unit", "amount"
+    )
+
+
+def _rows(queryset):
+    return queryset.iterator(chunk_size=CHUNK_SIZE)
+
+
+def stream_txt(queryset):
+    for name, measurement_unit, amount in _rows(queryset):
+        yield f"{name} ({measurement_unit}) - {amount}\n"
+
+
+class _Echo:
+    """
+    Буфер для csv.writer, который отдаёт строку вместо записи в файл.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(("name", "measurement_unit", "amount"))
+    for row in _rows(queryset):
+        yield writer.writerow(row)
+
+
+def stream_json(queryset):
+    separator = ""
+    yield "["
+    for name, measurement_unit, amount in _rows(queryset):
+        item = {
+            "name": name,
+            "measurement_unit": measurement_unit,
+            "amount": str(amount),
+        }
+        yield separator + json.dumps(item, ensure_ascii=False)
+        separator = ","
+    yield "]"
+
+
+FORMATS = {
+    "txt": ("text/plain; charset=utf-8", stream_txt),
+    "csv": ("text/csv; charset=utf-8", stream_csv),
+    "json": ("application/json", stream_json),
+}
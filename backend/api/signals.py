@@ -0,0 +1,176 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from import_export.signals import post_import
+from recipes.models import (
+    Favorite,
+    Follow,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag,
+    TagRecipe,
+)
+from recipes.signals import recipe_ingredients_saved
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .data_version import (
+    FAVORITES,
+    INGREDIENTS,
+    RECIPE_INGREDIENTS,
+    TAGS,
+    bump_data_version,
+    bump_recipe_versions,
+    user_version_name,
+)
+from .recipe_ingredient_index import recipe_ingredient_index
+
+User = get_user_model()
+
+DATA_VERSIONS = {
+    Tag: TAGS,
+    Ingredient: INGREDIENTS,
+}
+
+# Справочники, которые выводятся внутри рецептов, и их связь с рецептами
+RECIPE_RELATIONS = {
+    Tag: (TagRecipe, "tag"),
+    Ingredient: (IngredientRecipe, "ingredient"),
+}
+
+
+def bump_on_commit(model):
+    name = DATA_VERSIONS.get(model)
+    if name is not None:
+        # Версию меняем после коммита, иначе другой процесс может успеть
+        # закешировать старые данные уже под новой версией.
+        transaction.on_commit(lambda: bump_data_version(name))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def reference_data_changed(sender, **kwargs):
+    bump_on_commit(sender)
+
+
+@receiver(post_import)
+def reference_data_imported(sender, model, **kwargs):
+    bump_on_commit(model)
+
+
+@receiver(recipe_ingredients_saved)
+def recipe_ingredients_changed(sender, recipe_id, ingredient_ids, **kwargs):
+    ingredient_ids = tuple(ingredient_ids)
+    transaction.on_commit(
+        lambda: recipe_ingredient_index.publish(recipe_id, ingredient_ids)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_ingredients_deleted(sender, instance, **kwargs):
+    recipe_id = instance.pk
+    transaction.on_commit(
+        lambda: recipe_ingredient_index.publish(recipe_id, None)
+    )
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, **kwargs):
+    # Ингредиент удаляется из рецептов каскадом, без сигналов по каждому
+    # рецепту: индекс перестраивается целиком
+    transaction.on_commit(lambda: bump_data_version(RECIPE_INGREDIENTS))
+
+
+def forget_tokens_on_commit(keys):
+    def forget():
+        for key in keys:
+            token_cache.delete(key)
+
+    transaction.on_commit(forget)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    forget_tokens_on_commit([instance.key])
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Смена пароля, деактивация и правка профиля сбрасывают кеш токенов,
+    # удаление пользователя - каскадным удалением токена
+    forget_tokens_on_commit(
+        list(
+            Token.objects.filter(user_id=instance.pk).values_list(
+                "key", flat=True
+            )
+        )
+    )
+
+
+def bump_recipes_on_commit(recipe_ids):
+    recipe_ids = set(recipe_ids)
+    transaction.on_commit(lambda: bump_recipe_versions(recipe_ids))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    bump_recipes_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=TagRecipe)
+@receiver(post_delete, sender=TagRecipe)
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def recipe_relation_changed(sender, instance, **kwargs):
+    bump_recipes_on_commit([instance.recipe_id])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def recipe_reference_changed(sender, instance, created, **kwargs):
+    # Удаление тега или ингредиента удаляет связи с рецептами каскадом,
+    # и их сигналы сбрасывают кеш этих рецептов
+    if created:
+        return
+    relation, field = RECIPE_RELATIONS[sender]
+    recipe_ids = list(
+        relation.objects.filter(**{field: instance}).values_list(
+            "recipe_id", flat=True
+        )
+    )
+    if recipe_ids:
+        bump_recipes_on_commit(recipe_ids)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, **kwargs):
+    if created:
+        return
+    recipe_ids = list(
+        Recipe.objects.filter(author=instance).values_list("pk", flat=True)
+    )
+    if recipe_ids:
+        bump_recipes_on_commit(recipe_ids)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def favorite_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_data_version(FAVORITES))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def user_relation_changed(sender, instance, **kwargs):
+    name = user_version_name(instance.user_id)
+    transaction.on_commit(lambda: bump_data_version(name))
@@ -0,0 +1,21 @@
+import json
+
+
+class QueryBudgetMixin:
+    """
+    Примесь для TestCase: проверяет, что запрос к API уложился в бюджет
+    SQL-запросов из settings.QUERY_BUDGETS. Метрики ответу добавляет
+    api.middleware.PerformanceMiddleware.
+    """
+
+    def assert_query_budget(self, response, budget=None):
+        metrics = response.performance
+        if budget is None:
+            budget = metrics.budget
+        if budget is None:
+            self.fail(f"Для {metrics.budget_key} не задан бюджет запросов.")
+        self.assertLessEqual(
+            metrics.queries,
+            budget,
+            json.dumps(metrics.as_dict(), ensure_ascii=False, indent=2),
+        )
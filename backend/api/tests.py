@@ -0,0 +1,427 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from recipes import counters, feed, models, shopping_list
+from recipes.similar import update_similar_recipes
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from users.models import User
+
+from .filtersets import RecipeFilter
+from .recipe_ingredient_index import (
+    RecipeIngredientIndex,
+    recipe_ingredient_index,
+)
+from .testing import QueryBudgetMixin
+
+MEDIA_ROOT = tempfile.mkdtemp()
+IMAGE = (
+    "data:image/gif;base64,"
+    "R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw=="
+)
+
+
+class RecipeTestData:
+    """
+    Пользователь с токеном, авторы с рецептами, избранное, список покупок
+    и подписки.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            "user", "user@example.com", "password", first_name="Иван",
+            last_name="Иванов",
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        cls.authors = [
+            User.objects.create_user(
+                f"author{i}", f"author{i}@example.com", "password",
+                first_name="Пётр", last_name="Петров",
+            )
+            for i in range(3)
+        ]
+        cls.tags = [
+            models.Tag.objects.create(
+                name=f"Тег {i}", color=f"#00000{i}", slug=f"tag{i}"
+            )
+            for i in range(2)
+        ]
+        cls.ingredients = [
+            models.Ingredient.objects.create(
+                name=f"Ингредиент {i}", measurement_unit="г"
+            )
+            for i in range(10)
+        ]
+        cls.recipes = []
+        for i in range(40):
+            recipe = models.Recipe.objects.create(
+                author=cls.authors[i % len(cls.authors)],
+                name=f"Рецепт {i}",
+                image="recipes/images/recipe.gif",
+                text="Описание",
+                cooking_time=10,
+            )
+            recipe.tags.set(cls.tags[:i % 2 + 1])
+            models.IngredientRecipe.objects.bulk_create(
+                models.IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=i + 1
+                )
+                for ingredient in cls.ingredients[i % 5:i % 5 + 3]
+            )
+            if i % 2:
+                models.Favorite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3:
+                models.ShoppingCart.objects.create(
+                    user=cls.user, recipe=recipe
+                )
+            cls.recipes.append(recipe)
+        models.Follow.objects.create(user=cls.user, author=cls.authors[0])
+
+    def setUp(self):
+        cache.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+
+class RecipeListQueriesTest(RecipeTestData, APITestCase):
+    def test_query_count_does_not_depend_on_page_size(self):
+        # Первый запрос кеширует токен
+        self.client.get("/api/recipes/?limit=1")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/recipes/?limit=3")
+        self.assertEqual(len(response.data["results"]), 3)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get("/api/recipes/?limit=30")
+        self.assertEqual(len(response.data["results"]), 30)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class QueryBudgetTest(QueryBudgetMixin, RecipeTestData, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.own_recipe = models.Recipe.objects.create(
+            author=cls.user,
+            name="Свой рецепт",
+            image="recipes/images/recipe.gif",
+            text="Описание",
+            cooking_time=5,
+        )
+        cls.own_recipe.tags.set(cls.tags[:1])
+        models.IngredientRecipe.objects.bulk_create(
+            models.IngredientRecipe(
+                recipe=cls.own_recipe, ingredient=ingredient, amount=1
+            )
+            for ingredient in cls.ingredients[:2]
+        )
+        # PATCH меняет ингредиенты и в списках покупок этих пользователей
+        for user in (cls.user, cls.authors[1]):
+            models.ShoppingCart.objects.create(
+                user=user, recipe=cls.own_recipe
+            )
+        update_similar_recipes(full=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def recipe_data(self, **data):
+        return {
+            "name": "Новый рецепт",
+            "text": "Описание",
+            "cooking_time": 15,
+            "image": IMAGE,
+            "tags": [tag.id for tag in self.tags],
+            "ingredients": [
+                {"id": ingredient.id, "amount": 2}
+                for ingredient in self.ingredients[:4]
+            ],
+            **data,
+        }
+
+    def budget_requests(self):
+        recipe = self.recipes[0]
+        return {
+            "GET api:recipes-list": ("get", "/api/recipes/", None),
+            "POST api:recipes-list": (
+                "post", "/api/recipes/", self.recipe_data()
+            ),
+            "GET api:recipes-detail": (
+                "get", f"/api/recipes/{recipe.id}/", None
+            ),
+            "PATCH api:recipes-detail": (
+                "patch",
+                f"/api/recipes/{self.own_recipe.id}/",
+                self.recipe_data(
+                    tags=[self.tags[1].id],
+                    ingredients=[
+                        {"id": self.ingredients[0].id, "amount": 3},
+                        {"id": self.ingredients[5].id, "amount": 1},
+                    ],
+                ),
+            ),
+            "GET api:recipes-feed": ("get", "/api/recipes/feed/", None),
+            "GET api:recipes-similar": (
+                "get", f"/api/recipes/{recipe.id}/similar/", None
+            ),
+            "GET api:recipes-download-shopping-cart": (
+                "get", "/api/recipes/download_shopping_cart/", None
+            ),
+            "GET api:recipes-shopping-cart": (
+                "get", "/api/recipes/shopping_cart/", None
+            ),
+            "GET api:follow-list": (
+                "get", "/api/users/subscriptions/", None
+            ),
+            "GET api:tags-list": ("get", "/api/tags/", None),
+            "GET api:ingredients-list": ("get", "/api/ingredients/", None),
+        }
+
+    def test_every_budget_is_checked(self):
+        self.assertEqual(
+            self.budget_requests().keys(), settings.QUERY_BUDGETS.keys()
+        )
+
+    def test_query_budgets(self):
+        for key, (method, url, data) in self.budget_requests().items():
+            with self.subTest(key):
+                # Токен и кеши не прогреты: бюджет на худший случай
+                cache.clear()
+                response = getattr(self.client, method)(
+                    url, data, format="json"
+                )
+                self.assertLess(
+                    response.status_code, 300, getattr(response, "data", None)
+                )
+                if response.streaming:
+                    # Запросы потокового ответа делаются при чтении тела
+                    b"".join(response.streaming_content)
+                self.assertEqual(response.performance.budget_key, key)
+                self.assert_query_budget(response)
+
+
+class ConditionalRequestTest(RecipeTestData, APITestCase):
+    def test_list_not_modified_without_queries(self):
+        # Первый запрос кеширует токен
+        response = self.client.get("/api/recipes/")
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/api/recipes/", HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_modified_after_recipe_change(self):
+        etag = self.client.get("/api/recipes/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[0].delete()
+        response = self.client.get("/api/recipes/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_anonymous_list_if_modified_since(self):
+        self.client.credentials()
+        response = self.client.get("/api/recipes/")
+        last_modified = response["Last-Modified"]
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/api/recipes/", HTTP_IF_MODIFIED_SINCE=last_modified
+            )
+        self.assertEqual(response.status_code, 304)
+        # Last-Modified с точностью до секунды
+        later = timezone.now() + timedelta(seconds=1)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.recipes[0].delete()
+        response = self.client.get(
+            "/api/recipes/", HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class BulkDeleteTest(RecipeTestData, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.followed = [
+            User.objects.create_user(
+                f"followed{i}", f"followed{i}@example.com", "password",
+                first_name="Сидор", last_name="Сидоров",
+            )
+            for i in range(12)
+        ]
+        for author in cls.followed:
+            models.Follow.objects.create(user=cls.user, author=author)
+            models.Recipe.objects.create(
+                author=author,
+                name="Рецепт подписки",
+                image="recipes/images/recipe.gif",
+                text="Описание",
+                cooking_time=10,
+            )
+
+    def assert_derived_data(self):
+        self.assertFalse(any(counters.reconcile().values()))
+        # Строки с recipes_count = 0 остаются после удаления рецептов из
+        # списка, но не читаются
+        items = models.ShoppingListItem.objects.filter(
+            recipes_count__gt=0
+        ).values_list("user_id", "ingredient_id", "amount", "recipes_count")
+        incremental = set(items)
+        shopping_list.rebuild_shopping_lists()
+        self.assertEqual(incremental, set(items.all()))
+        entries = models.FeedEntry.objects.values_list(
+            "user_id", "recipe_id", "author_id"
+        )
+        incremental = set(entries)
+        feed.rebuild_feed()
+        self.assertEqual(incremental, set(entries.all()))
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        relations = {
+            "/api/recipes/favorite/bulk/": models.Favorite.objects.filter(
+                user=self.user
+            ).values_list("recipe_id", flat=True),
+            "/api/recipes/shopping_cart/bulk/": (
+                models.ShoppingCart.objects.filter(user=self.user)
+                .values_list("recipe_id", flat=True)
+            ),
+            "/api/users/subscribe/bulk/": models.Follow.objects.filter(
+                user=self.user
+            ).values_list("author_id", flat=True),
+        }
+        # Первый запрос кеширует токен
+        self.client.get("/api/tags/")
+        for url, related in relations.items():
+            with self.subTest(url):
+                ids = sorted(related)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.delete(
+                        url, {"ids": ids[:2]}, format="json"
+                    )
+                self.assertEqual(response.status_code, 200)
+                with self.assertNumQueries(len(queries)):
+                    response = self.client.delete(
+                        url, {"ids": ids[2:12]}, format="json"
+                    )
+                statuses = {
+                    result["status"] for result in response.data["results"]
+                }
+                self.assertEqual(statuses, {"deleted"})
+                self.assertEqual(set(related.all()), set(ids[12:]))
+        self.assert_derived_data()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeIngredientIndexTest(RecipeTestData, APITestCase):
+    def assert_index_matches_rebuild(self):
+        fresh = RecipeIngredientIndex()
+        self.assertEqual(
+            recipe_ingredient_index._get_index(), fresh._get_index()
+        )
+
+    def test_changes_are_applied_incrementally(self):
+        recipe_ingredient_index._get_index()
+        data = {
+            "name": "Новый рецепт",
+            "text": "Описание",
+            "cooking_time": 15,
+            "image": IMAGE,
+            "tags": [self.tags[0].id],
+            "ingredients": [
+                {"id": ingredient.id, "amount": 2}
+                for ingredient in self.ingredients[7:]
+            ],
+        }
+        build = mock.patch.object(
+            RecipeIngredientIndex, "_build", side_effect=AssertionError
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/recipes/", data, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        with build:
+            recipe_ingredient_index._get_index()
+        self.assert_index_matches_rebuild()
+
+        data["ingredients"] = [{"id": self.ingredients[0].id, "amount": 1}]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f"/api/recipes/{response.data['id']}/", data, format="json"
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        with build:
+            recipe_ingredient_index._get_index()
+        self.assert_index_matches_rebuild()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                f"/api/recipes/{response.data['id']}/"
+            )
+        self.assertEqual(response.status_code, 204)
+        with build:
+            recipe_ingredient_index._get_index()
+        self.assert_index_matches_rebuild()
+
+    def get_ids(self, query):
+        response = self.client.get(f"/api/recipes/?limit=100&{query}")
+        return [recipe["id"] for recipe in response.data["results"]]
+
+    def test_match_any_is_ranked_and_capped(self):
+        ingredient_ids = [ingredient.id for ingredient in self.ingredients[:4]]
+        query = f"ingredients={','.join(map(str, ingredient_ids))}&match=any"
+        with mock.patch.object(recipe_ingredient_index, "rank_limit", 5):
+            self.assertEqual(
+                self.get_ids(query),
+                recipe_ingredient_index.rank(ingredient_ids),
+            )
+        self.assertEqual(
+            len(self.get_ids(query)),
+            len(recipe_ingredient_index.match_any(ingredient_ids)),
+        )
+
+    def test_large_matches_are_filtered_in_sql(self):
+        query = (
+            f"ingredients={self.ingredients[2].id},{self.ingredients[3].id}"
+            f"&exclude_ingredients={self.ingredients[0].id}"
+        )
+        expected = self.get_ids(query)
+        self.assertTrue(expected)
+        with mock.patch.object(RecipeFilter, "ID_LIST_LIMIT", 1):
+            self.assertEqual(self.get_ids(query), expected)
+
+
+class CursorPaginationTest(RecipeTestData, APITestCase):
+    def test_cursor_follows_id_order(self):
+        response = self.client.get("/api/recipes/?pagination=cursor&limit=5")
+        self.assertEqual(response.status_code, 200)
+        ids = [recipe["id"] for recipe in response.data["results"]]
+        response = self.client.get(response.data["next"])
+        ids += [recipe["id"] for recipe in response.data["results"]]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertEqual(len(set(ids)), 10)
+
+    def test_cursor_rejects_own_ordering(self):
+        ingredient = self.ingredients[0].id
+        for query in (
+            "search=Рецепт",
+            "ordering=favorites",
+            f"ingredients={ingredient}&match=any",
+        ):
+            with self.subTest(query):
+                response = self.client.get(
+                    f"/api/recipes/?pagination=cursor&{query}"
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("pagination", response.data)
+        response = self.client.get(
+            f"/api/recipes/?pagination=cursor&ingredients={ingredient}"
+        )
+        self.assertEqual(response.status_code, 200)
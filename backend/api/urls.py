@@ -11,6 +11,16 @@ router_v1.register(r"tags", views.TagViewSet, basename="tags")
 router_v1.register(
     r"ingredients", views.IngredientsViewSet, basename="ingredients"
 )
+router_v1.register(
+    r"recipes/favorite/bulk",
+    views.FavoriteBulkViewSet,
+    basename="favorite-bulk",
+)
+router_v1.register(
+    r"recipes/shopping_cart/bulk",
+    views.ShoppingCartBulkViewSet,
+    basename="shopping_cart-bulk",
+)
 router_v1.register(r"recipes", views.RecipesViewSet, basename="recipes")
 router_v1.register(
     r"recipes/(?P<recipe_id>\d+)/favorite",
@@ -28,6 +38,9 @@ router_v1.register(
 router_v1.register(
     r"users/subscriptions", views.SubscriptionsViewSet, basename="follow"
 )
+router_v1.register(
+    r"users/subscribe/bulk", views.FollowBulkViewSet, basename="follow-bulk"
+)
 
 urlpatterns = [
     path("", include(router_v1.urls)),
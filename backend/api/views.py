@@ -1,91 +1,280 @@
-import tempfile
 from datetime import datetime as dt
 
 from django.contrib.auth import get_user_model
-from django.http import FileResponse
+from django.db import transaction
+from django.db.models import (
+    Exists,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    Value,
+)
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from recipes import models
+from recipes import feed, models, shopping_list
+from recipes.counters import increment_many
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.filters import SearchFilter
+from rest_framework.exceptions import ValidationError
 from rest_framework.mixins import (
     CreateModelMixin,
     ListModelMixin,
 )
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import (
     GenericViewSet,
     ModelViewSet,
     ReadOnlyModelViewSet,
 )
 
-from . import serializers
+from . import serializers, shopping_cart
+from .async_views import AsyncReadViewMixin
+from .cache import AnonymousRecipeCacheMixin, ReferenceDataCacheMixin
+from .conditional import ConditionalRecipeMixin
+from .data_version import (
+    FAVORITES,
+    INGREDIENTS,
+    TAGS,
+    bump_data_version,
+    user_version_name,
+)
 from .filtersets import RecipeFilter
-from .pagination import PageNumberLimitPagination
+from .ingredient_index import ingredient_index
+from .negotiation import IgnoreClientContentNegotiation
+from .pagination import CursorLimitPagination, PageNumberLimitPagination
 
 User = get_user_model()
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(
+    AsyncReadViewMixin, ReferenceDataCacheMixin, ReadOnlyModelViewSet
+):
+    data_version_name = TAGS
     queryset = models.Tag.objects.all()
     serializer_class = serializers.TagSerializer
     pagination_class = None
 
 
-class IngredientsViewSet(ReadOnlyModelViewSet):
+class IngredientsViewSet(
+    AsyncReadViewMixin, ReferenceDataCacheMixin, ReadOnlyModelViewSet
+):
+    data_version_name = INGREDIENTS
     queryset = models.Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
     pagination_class = None
-    filter_backends = (SearchFilter,)
-    search_fields = ("^name",)
 
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(self.search, request)
+
+    def search(self, request):
+        name = request.query_params.get(api_settings.SEARCH_PARAM)
+        if name:
+            return Response(ingredient_index.search(name))
+        return Response(ingredient_index.all())
 
-class RecipesViewSet(ModelViewSet):
+
+class RecipesViewSet(
+    AsyncReadViewMixin,
+    AnonymousRecipeCacheMixin,
+    ConditionalRecipeMixin,
+    ModelViewSet,
+):
     queryset = models.Recipe.objects.all()
     serializer_class = serializers.RecipeSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
-    pagination_classes = PageNumberLimitPagination
+    pagination_class = PageNumberLimitPagination
+
+    @property
+    def paginator(self):
+        """
+        Переключается на пагинацию по ключу, если клиент передал
+        pagination=cursor или курсор следующей страницы.
+        """
+        if not hasattr(self, "_paginator"):
+            params = self.request.query_params
+            if (
+                params.get("pagination") == "cursor"
+                or CursorLimitPagination.cursor_query_param in params
+            ):
+                self._paginator = CursorLimitPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def paginate_queryset(self, queryset):
+        if isinstance(self.paginator, CursorLimitPagination):
+            self.check_cursor_ordering()
+        return super().paginate_queryset(queryset)
+
+    def check_cursor_ordering(self):
+        """
+        Курсор строится по id, поэтому пагинация по курсору не сочетается с
+        параметрами, которые задают свой порядок списка.
+        """
+        params = self.request.query_params
+        names = [name for name in ("search", "ordering") if params.get(name)]
+        if params.get("match") == "any" and params.get("ingredients"):
+            names.append("match")
+        if names:
+            raise ValidationError({
+                "pagination": (
+                    "Пагинация по курсору недоступна с параметрами: "
+                    f"{', '.join(names)}."
+                )
+            })
+
+    def get_serializer_class(self):
+        # Для чтения не нужен разбор тегов и ингредиентов на запись
+        if self.request.method in SAFE_METHODS:
+            return serializers.RecipeReadSerializer
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        """
+        Возвращает рецепты вместе со всеми данными, которые нужны
+        сериализатору, чтобы число запросов не зависело от размера страницы.
+        Подгрузка и аннотации для полей, убранных параметрами fields и
+        omit, пропускаются.
+        """
+        user = self.request.user
+        params = self.request.query_params
+        fields = set(
+            serializers.RecipeReadSerializer.select_fields(self.request)
+        )
+        # Поисковый вектор нужен только базе
+        queryset = self.queryset.defer("search_vector")
+        for field, column in (("text", "text"), ("images", "image_variants")):
+            if field not in fields:
+                queryset = queryset.defer(column)
+        if "author" in fields:
+            queryset = queryset.select_related("author")
+        if "tags" in fields:
+            queryset = queryset.prefetch_related("tags")
+        if "ingredients" in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    "ingredients",
+                    queryset=models.IngredientRecipe.objects.select_related(
+                        "ingredient"
+                    ),
+                )
+            )
+
+        # Аннотации нужны полям ответа и одноимённым фильтрам
+        names = [
+            name
+            for name in ("is_favorited", "is_in_shopping_cart")
+            if name in fields or name in params
+        ]
+        if "author" in fields:
+            names.append("author_is_subscribed")
+        if not user.is_authenticated:
+            return queryset.annotate(**{name: Value(False) for name in names})
+        subqueries = {
+            "is_favorited": models.Favorite.objects.filter(
+                user=user, recipe=OuterRef("pk")
+            ),
+            "is_in_shopping_cart": models.ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef("pk")
+            ),
+            "author_is_subscribed": models.Follow.objects.filter(
+                user=user, author=OuterRef("author")
+            ),
+        }
+        return queryset.annotate(
+            **{name: Exists(subqueries[name]) for name in names}
+        )
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(detail=True)
+    def similar(self, request, pk=None):
+        """
+        Рецепты, похожие на рецепт pk по ингредиентам и тегам, из
+        заранее посчитанной таблицы (recipes.similar).
+        """
+        get_object_or_404(models.Recipe.objects.only("id"), pk=pk)
+        queryset = (
+            self.get_queryset()
+            .filter(similar_to__recipe_id=pk)
+            .order_by("-similar_to__score", "id")
+        )
+        serializer = serializers.RecipeReadSerializer(
+            queryset, many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """
+        Рецепты авторов, на которых подписан пользователь, из его ленты.
+        """
+        queryset = self.filter_queryset(
+            self.get_queryset().filter(feed_recipe__user=request.user)
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = serializers.RecipeReadSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    def update(self, request, *args, **kwargs):
+        """
+        UpdateModelMixin.update без сброса кеша prefetch после записи:
+        RecipeSerializer.update сам кладёт в него новые теги и ингредиенты,
+        и ответ не подгружает их второй раз.
+        """
+        partial = kwargs.pop("partial", False)
+        instance = self.get_object()
+        serializer = self.get_serializer(
+            instance, data=request.data, partial=partial
+        )
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response(serializer.data)
+
     def perform_update(self, serializer):
         serializer.save(author=self.request.user)
 
-    @action(detail=False)
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def shopping_cart(self, request):
+        """
+        Список покупок пользователя в JSON, без скачивания файла.
+        """
+        items = shopping_cart.get_shopping_list(request.user).select_related(
+            "ingredient"
+        )
+        serializer = serializers.ShoppingListItemSerializer(items, many=True)
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        content_negotiation_class=IgnoreClientContentNegotiation,
+    )
     def download_shopping_cart(self, request):
-        user = request.user
-        ingredients_amounts = models.IngredientRecipe.objects.filter(
-            recipe__shopping_cart_recipe__user=user
-        )
-
-        # Суммируем количество ингредиентов
-        ingredients_dct = dict()
-        for ingredient_amount in ingredients_amounts:
-            ingredient = ingredient_amount.ingredient
-            amount = ingredient_amount.amount
-            if ingredient not in ingredients_dct:
-                ingredients_dct[ingredient] = amount
-            else:
-                ingredients_dct[ingredient] += amount
-
-        filename = "shopping_cart_{0:%S%f}.txt".format(dt.now())
-        f = tempfile.NamedTemporaryFile(mode="w+", delete=False)
-        open(f.name, "w")
-        for ingr_k, ingr_v in ingredients_dct.items():
-            name = ingr_k.name
-            measurement_unit = ingr_k.measurement_unit
-            amount = ingr_v
-            st = f"{name} ({measurement_unit}) - {amount}"
-            f.write(st + "\n")
-        f.close()
-
-        return FileResponse(
-            open(f.name, "rb"), as_attachment=True, filename=filename
+        file_format = request.query_params.get("format", "txt")
+        if file_format not in shopping_cart.FORMATS:
+            formats = ", ".join(shopping_cart.FORMATS)
+            raise ValidationError(
+                {"format": f"Допустимые форматы: {formats}."}
+            )
+        content_type, stream = shopping_cart.FORMATS[file_format]
+        ingredients = shopping_cart.get_shopping_cart(request.user)
+
+        filename = "shopping_cart_{0:%S%f}.{1}".format(dt.now(), file_format)
+        response = StreamingHttpResponse(
+            stream(ingredients), content_type=content_type
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{filename}"'
         )
+        return response
 
 
 class CreateViewSet(CreateModelMixin, GenericViewSet):
@@ -152,11 +341,215 @@ class ShoppingCartViewSet(CreateViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class FollowViewSet(CreateViewSet):
+class BulkRelationViewSet(GenericViewSet):
+    """
+    Добавляет и удаляет связи пользователя сразу с несколькими объектами.
+
+    Переданные id и существующие связи проверяются двумя запросами, новые
+    связи создаются одним bulk_create, а удаляемые - одним DELETE. Сигналы
+    моделей связей при этом не отправляются: счётчики обновляются одним
+    UPDATE, а производные данные - в after_create и after_delete, поэтому
+    число запросов не зависит от количества id. В ответе для каждого id
+    возвращается результат операции.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    serializer_class = serializers.BulkIdsSerializer
+    relation_model = None
+    target_model = None
+    target_field = None
+    counter_field = None
+
+    def get_targets(self, request):
+        """
+        Возвращает переданные id и словарь {id: есть ли связь} для
+        существующих объектов.
+
+        Вызывается в транзакции: строки объектов блокируются до чтения
+        связей, поэтому параллельный запрос с теми же id ждёт её завершения
+        и видит уже созданные связи, а счётчики и производные данные не
+        обновляются дважды. Связи читаются отдельным запросом: подзапрос в
+        блокирующем SELECT видел бы данные на момент до ожидания блокировки.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data["ids"]))
+        existing = list(
+            self.target_model.objects.select_for_update()
+            .filter(pk__in=ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        related = set(
+            self.relation_model.objects.filter(
+                user=request.user,
+                **{f"{self.target_field}_id__in": existing},
+            ).values_list(f"{self.target_field}_id", flat=True)
+        )
+        targets = {pk: pk in related for pk in existing}
+        return ids, targets
+
+    def after_create(self, user, target_ids):
+        """
+        Вызывается в транзакции после создания связей с target_ids.
+        """
+
+    def after_delete(self, user, target_ids):
+        """
+        Вызывается в транзакции перед удалением связей с target_ids.
+        """
+
+    @transaction.atomic
+    def create(self, request, *args, **kwargs):
+        ids, targets = self.get_targets(request)
+        new_ids = [pk for pk, related in targets.items() if not related]
+        if new_ids:
+            self.relation_model.objects.bulk_create(
+                [
+                    self.relation_model(
+                        user=request.user, **{f"{self.target_field}_id": pk}
+                    )
+                    for pk in new_ids
+                ],
+                ignore_conflicts=True,
+            )
+            increment_many(self.target_model, new_ids, self.counter_field)
+            name = user_version_name(request.user.pk)
+            transaction.on_commit(lambda: bump_data_version(name))
+            self.after_create(request.user, new_ids)
+        results = [
+            {
+                "id": pk,
+                "status": (
+                    "not_found" if pk not in targets
+                    else "exists" if targets[pk]
+                    else "created"
+                ),
+            }
+            for pk in ids
+        ]
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    @transaction.atomic
+    def delete(self, request, *args, **kwargs):
+        ids, targets = self.get_targets(request)
+        related_ids = [pk for pk, related in targets.items() if related]
+        if related_ids:
+            increment_many(
+                self.target_model, related_ids, self.counter_field, -1
+            )
+            name = user_version_name(request.user.pk)
+            transaction.on_commit(lambda: bump_data_version(name))
+            self.after_delete(request.user, related_ids)
+            # Без Collector и сигналов post_delete для каждой строки
+            relations = self.relation_model.objects.filter(
+                user=request.user,
+                **{f"{self.target_field}_id__in": related_ids},
+            )
+            relations._raw_delete(relations.db)
+        results = [
+            {
+                "id": pk,
+                "status": (
+                    "not_found" if pk not in targets
+                    else "deleted" if targets[pk]
+                    else "absent"
+                ),
+            }
+            for pk in ids
+        ]
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class FavoriteBulkViewSet(BulkRelationViewSet):
+    relation_model = models.Favorite
+    target_model = models.Recipe
+    target_field = "recipe"
+    counter_field = "favorites_count"
+
+    def after_create(self, user, target_ids):
+        # bulk_create не вызывает сигналы, которые сбрасывают кеш списков
+        # с сортировкой по популярности
+        transaction.on_commit(lambda: bump_data_version(FAVORITES))
+
+    def after_delete(self, user, target_ids):
+        transaction.on_commit(lambda: bump_data_version(FAVORITES))
+
+
+class ShoppingCartBulkViewSet(BulkRelationViewSet):
+    relation_model = models.ShoppingCart
+    target_model = models.Recipe
+    target_field = "recipe"
+    counter_field = "shopping_carts_count"
+
+    def after_create(self, user, target_ids):
+        # bulk_create не вызывает сигналы, которые обновляют список покупок
+        shopping_list.add_recipes(user.id, target_ids)
+
+    def after_delete(self, user, target_ids):
+        shopping_list.remove_recipes(user.id, target_ids)
+
+
+class FollowBulkViewSet(BulkRelationViewSet):
+    relation_model = models.Follow
+    target_model = User
+    target_field = "author"
+    counter_field = "followers_count"
+
+    def after_create(self, user, target_ids):
+        feed.backfill_follows(user.id, target_ids)
+
+    def after_delete(self, user, target_ids):
+        feed.prune_follows(user.id, target_ids)
+
+
+class SubscriptionMixin:
+    """
+    Готовит queryset авторов для UserSubscribeSerializer: рецепты
+    подгружаются одним запросом с ограничением recipes_limit на каждого
+    автора.
+    """
+
+    def get_recipes_limit(self):
+        try:
+            recipes_limit = int(self.request.query_params["recipes_limit"])
+        except (KeyError, ValueError):
+            return None
+        return recipes_limit if recipes_limit > 0 else None
+
+    def annotate_subscriptions(self, queryset):
+        queryset = queryset.annotate(is_subscribed=Value(True))
+        fields = serializers.UserSubscribeSerializer.select_fields(
+            self.request
+        )
+        if "recipes" not in fields:
+            return queryset
+        recipes = models.Recipe.objects.only(
+            "id", "author_id", "name", "image", "image_variants",
+            "cooking_time",
+        )
+        recipes_limit = self.get_recipes_limit()
+        if recipes_limit is not None:
+            # Django 3.2 не умеет фильтровать по оконным функциям,
+            # поэтому первые N рецептов автора выбираем подзапросом.
+            recipes = recipes.filter(
+                pk__in=Subquery(
+                    models.Recipe.objects.filter(
+                        author=OuterRef("author")
+                    ).values("pk")[:recipes_limit]
+                )
+            )
+        return queryset.prefetch_related(Prefetch("recipes", queryset=recipes))
+
+
+class FollowViewSet(SubscriptionMixin, CreateViewSet):
     permission_classes = (IsAuthenticated,)
 
     def create(self, request, *args, **kwargs):
-        author = get_object_or_404(User, id=self.kwargs.get("user_id"))
+        author = get_object_or_404(
+            self.annotate_subscriptions(User.objects.all()),
+            id=self.kwargs.get("user_id"),
+        )
         models.Follow.objects.get_or_create(
             user=request.user,
             author=author,
@@ -181,10 +574,14 @@ class FollowViewSet(CreateViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class SubscriptionsViewSet(ListModelMixin, GenericViewSet):
+class SubscriptionsViewSet(
+    AsyncReadViewMixin, SubscriptionMixin, ListModelMixin, GenericViewSet
+):
     permission_classes = (IsAuthenticated,)
     serializer_class = serializers.UserSubscribeSerializer
 
     def get_queryset(self):
         user = self.request.user
-        return User.objects.filter(following__user=user)
+        return self.annotate_subscriptions(
+            User.objects.filter(following__user=user)
+        )
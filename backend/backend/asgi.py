@@ -0,0 +1,18 @@
+"""
+ASGI config for backend project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from api.async_views import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+# Под ASGI читающие представления выполняются параллельно в пуле потоков
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+
+application = get_asgi_application()
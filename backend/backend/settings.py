@@ -59,6 +59,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.PerformanceMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,6 +88,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 
 # Database
@@ -105,6 +107,16 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND",
+            default="django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", default=""),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -160,12 +172,69 @@ AUTH_USER_MODEL = "users.User"  # Ссылка на кастомную моде
 REST_FRAMEWORK = {
     'SEARCH_PARAM': 'name',
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
+    ],
+    # JSON_RENDERER=api.renderers.ORJSONRenderer включает рендерер на orjson
+    "DEFAULT_RENDERER_CLASSES": [
+        os.getenv(
+            "JSON_RENDERER", default="rest_framework.renderers.JSONRenderer"
+        ),
+        "rest_framework.renderers.BrowsableAPIRenderer",
     ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 6,
 }
 
+# Кеш токенов авторизации (api.authentication): срок жизни записи в общем
+# кеше, срок жизни и размер LRU в памяти процесса
+TOKEN_CACHE_SHARED = os.getenv("TOKEN_CACHE_SHARED", default="True") == "True"
+TOKEN_CACHE_TIMEOUT = int(os.getenv("TOKEN_CACHE_TIMEOUT", default=300))
+TOKEN_CACHE_LOCAL_TIMEOUT = int(
+    os.getenv("TOKEN_CACHE_LOCAL_TIMEOUT", default=5)
+)
+TOKEN_CACHE_LOCAL_SIZE = 10000
+
+# Асинхронные представления для чтения (api.async_views). Включается по
+# умолчанию при запуске через backend.asgi
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", default="False") == "True"
+
+# Заголовок Server-Timing с метриками запроса (api.middleware)
+SERVER_TIMING = os.getenv("SERVER_TIMING", default="False") == "True"
+
+# Допустимое число SQL-запросов на метод и представление (api.testing)
+# с учётом SAVEPOINT и RELEASE SAVEPOINT при записи внутри TestCase
+QUERY_BUDGETS = {
+    "GET api:recipes-list": 6,
+    "POST api:recipes-list": 14,
+    "GET api:recipes-detail": 5,
+    "PATCH api:recipes-detail": 18,
+    "GET api:recipes-feed": 5,
+    "GET api:recipes-similar": 5,
+    "GET api:recipes-download-shopping-cart": 2,
+    "GET api:recipes-shopping-cart": 2,
+    "GET api:follow-list": 4,
+    "GET api:tags-list": 2,
+    "GET api:ingredients-list": 2,
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api.performance": {
+            "handlers": ["console"],
+            "level": os.getenv("PERFORMANCE_LOG_LEVEL", default="WARNING"),
+        },
+        "recipes.images": {
+            "handlers": ["console"],
+            "level": "ERROR",
+        },
+    },
+}
+
 DJOSER = {
     "LOGIN_FIELD": "email",
     "SERIALIZERS": {
@@ -1,7 +1,9 @@
 from django.contrib import admin
 from import_export.admin import ImportMixin
 
+from . import shopping_list
 from .models import Ingredient, IngredientRecipe, Recipe, Tag, TagRecipe
+from .signals import recipe_ingredients_saved
 
 
 class IngredientRecipeInline(admin.TabularInline):
@@ -26,7 +28,32 @@ class RecipeAdmin(admin.ModelAdmin):
     list_display = ("name", "author")
     search_fields = ("name",)
     list_filter = ("name", "author", "tags")
-    readonly_fields = ("favorite_count",)
+    readonly_fields = (
+        "favorites_count",
+        "shopping_carts_count",
+        "created_at",
+        "updated_at",
+    )
+
+    def save_related(self, request, form, formsets, change):
+        # Инлайн сохраняет ингредиенты мимо RecipeSerializer: изменения
+        # количеств переносятся в списки покупок и индекс ингредиентов здесь
+        amounts = form.instance.ingredients.values_list(
+            "ingredient_id", "amount"
+        )
+        old_amounts = dict(amounts)
+        super().save_related(request, form, formsets, change)
+        new_amounts = dict(amounts.all())
+        shopping_list.change_recipe(
+            form.instance.pk,
+            shopping_list.amount_deltas(old_amounts, new_amounts),
+        )
+        if old_amounts.keys() != new_amounts.keys():
+            recipe_ingredients_saved.send(
+                sender=Recipe,
+                recipe_id=form.instance.pk,
+                ingredient_ids=list(new_amounts),
+            )
 
 
 class IngredientAdmin(ImportMixin, admin.ModelAdmin):
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class RecipesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "recipes"
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import signals  # noqa: F401
+        from .search import setup_search
+
+        post_migrate.connect(setup_search, sender=self)
@@ -0,0 +1,61 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Favorite, Follow, Recipe, ShoppingCart
+
+User = get_user_model()
+
+# Счётчик: (модель со счётчиком, поле счётчика, модель строк, поле связи)
+COUNTERS = (
+    (Recipe, "favorites_count", Favorite, "recipe"),
+    (Recipe, "shopping_carts_count", ShoppingCart, "recipe"),
+    (User, "recipes_count", Recipe, "author"),
+    (User, "followers_count", Follow, "author"),
+)
+
+
+def increment(model, pk, field, delta=1):
+    """
+    Атомарно меняет счётчик field у объекта pk на delta.
+    """
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f"{field}__gte": -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def increment_many(model, pks, field, delta=1):
+    """
+    Атомарно меняет счётчик field на delta у всех объектов pks одним UPDATE.
+    """
+    queryset = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        queryset = queryset.filter(**{f"{field}__gte": -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def reconcile():
+    """
+    Пересчитывает все счётчики и исправляет разошедшиеся значения.
+    Возвращает число исправленных строк для каждого счётчика.
+    """
+    fixed = {}
+    for model, field, source, relation in COUNTERS:
+        actual = Coalesce(
+            Subquery(
+                source.objects.filter(**{relation: OuterRef("pk")})
+                .order_by()
+                .values(relation)
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            Value(0),
+        )
+        drifted = model.objects.annotate(actual=actual).filter(
+            ~Q(**{field: F("actual")})
+        )
+        fixed[f"{model.__name__}.{field}"] = model.objects.filter(
+            pk__in=drifted.values("pk")
+        ).update(**{field: actual})
+    return fixed
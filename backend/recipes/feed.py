@@ -0,0 +1,64 @@
+from .models import FeedEntry, Follow, Recipe
+
+BATCH_SIZE = 1000
+
+
+def _bulk_create(entries):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= BATCH_SIZE:
+            FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out_recipe(recipe):
+    """
+    Добавляет новый рецепт в ленты всех подписчиков его автора.
+    """
+    followers = Follow.objects.filter(author_id=recipe.author_id).values_list(
+        "user_id", flat=True
+    )
+    _bulk_create(
+        FeedEntry(user_id=user_id, recipe=recipe, author_id=recipe.author_id)
+        for user_id in followers.iterator(chunk_size=BATCH_SIZE)
+    )
+
+
+def backfill_follows(user_id, author_ids):
+    """
+    Добавляет в ленту подписчика все рецепты авторов author_ids.
+    """
+    recipes = Recipe.objects.filter(author_id__in=author_ids).values_list(
+        "id", "author_id"
+    )
+    _bulk_create(
+        FeedEntry(user_id=user_id, recipe_id=recipe_id, author_id=author_id)
+        for recipe_id, author_id in recipes.iterator(chunk_size=BATCH_SIZE)
+    )
+
+
+def backfill_follow(follow):
+    backfill_follows(follow.user_id, [follow.author_id])
+
+
+def prune_follows(user_id, author_ids):
+    """
+    Убирает из ленты подписчика рецепты авторов author_ids, от которых он
+    отписался.
+    """
+    FeedEntry.objects.filter(
+        user_id=user_id, author_id__in=author_ids
+    ).delete()
+
+
+def prune_follow(follow):
+    prune_follows(follow.user_id, [follow.author_id])
+
+
+def rebuild_feed():
+    FeedEntry.objects.all().delete()
+    for follow in Follow.objects.iterator(chunk_size=BATCH_SIZE):
+        backfill_follow(follow)
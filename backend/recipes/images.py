@@ -0,0 +1,138 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from api.data_version import bump_recipe_versions
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 2
+VARIANTS_DIR = "recipes/images/variants"
+
+# Вариант: (максимальный размер, формат, расширение)
+VARIANTS = {
+    "thumbnail": ((480, 480), "JPEG", "jpg"),
+    "thumbnail_webp": ((480, 480), "WEBP", "webp"),
+    "webp": ((1280, 1280), "WEBP", "webp"),
+}
+
+executor = ThreadPoolExecutor(
+    max_workers=WORKERS, thread_name_prefix="recipe-images"
+)
+
+
+def variant_name(image_name, variant):
+    root = os.path.splitext(os.path.basename(image_name))[0]
+    extension = VARIANTS[variant][2]
+    return f"{VARIANTS_DIR}/{root}_{variant}.{extension}"
+
+
+def variants_ready(recipe):
+    """
+    Созданы ли копии текущей картинки рецепта. Пока нет, рецепт ждёт
+    обработки: копии создаёт пул после коммита, а если обработка не прошла
+    (ошибка, перезапуск процесса) - команда generate_image_variants.
+    """
+    return all(
+        recipe.image_variants.get(variant)
+        == variant_name(recipe.image.name, variant)
+        for variant in VARIANTS
+    )
+
+
+def _render(image, size, image_format):
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=80, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_variants(image_name):
+    """
+    Создаёт уменьшенные копии и WebP-версии картинки и сохраняет их пути
+    во всех рецептах с этой картинкой. Уже созданные файлы не пересоздаются.
+    """
+    close_old_connections()
+    try:
+        with Recipe.image.field.storage.open(image_name) as original:
+            image = Image.open(original)
+            image.load()
+        variants = {}
+        for variant, (size, image_format, _) in VARIANTS.items():
+            name = variant_name(image_name, variant)
+            if not default_storage.exists(name):
+                name = default_storage.save(
+                    name, _render(image, size, image_format)
+                )
+            variants[variant] = name
+        recipes = Recipe.objects.filter(image=image_name)
+        recipe_ids = list(recipes.values_list("pk", flat=True))
+        recipes.update(image_variants=variants, updated_at=timezone.now())
+        # Ссылки на копии входят в закешированные ответы с рецептами
+        bump_recipe_versions(recipe_ids)
+    finally:
+        close_old_connections()
+
+
+def log_failure(image_name):
+    """
+    Колбэк задачи пула: пишет в лог ошибку обработки картинки image_name,
+    которую иначе никто бы не увидел.
+    """
+
+    def callback(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(
+                "Не удалось создать копии картинки %s",
+                image_name,
+                exc_info=future.exception(),
+            )
+
+    return callback
+
+
+def submit_variants(image_name):
+    future = executor.submit(generate_variants, image_name)
+    future.add_done_callback(log_failure(image_name))
+    return future
+
+
+def schedule_variants(recipe):
+    """
+    Ставит обработку картинки рецепта в очередь пула после коммита.
+    """
+    if recipe.image and not variants_ready(recipe):
+        image_name = recipe.image.name
+        transaction.on_commit(lambda: submit_variants(image_name))
+
+
+def pending_images(check_files=False):
+    """
+    Картинки рецептов, копии которых ещё не созданы. С check_files в них
+    попадают и картинки, файлов копий которых нет в хранилище.
+    """
+    recipes = Recipe.objects.exclude(image="").only("image", "image_variants")
+    names = set()
+    for recipe in recipes.iterator(chunk_size=1000):
+        if not variants_ready(recipe) or (
+            check_files
+            and not all(
+                default_storage.exists(name)
+                for name in recipe.image_variants.values()
+            )
+        ):
+            names.add(recipe.image.name)
+    return sorted(names)
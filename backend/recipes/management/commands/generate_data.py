@@ -0,0 +1,238 @@
+import random
+import time
+from datetime import timedelta
+from itertools import islice
+
+from api.data_version import (
+    FAVORITES,
+    INGREDIENTS,
+    RECIPE_INGREDIENTS,
+    TAGS,
+    bump_data_version,
+)
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from recipes.counters import reconcile
+from recipes.feed import rebuild_feed
+from recipes.search import rebuild_search_index
+from recipes.models import (
+    Favorite,
+    Follow,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag,
+    TagRecipe,
+)
+from recipes.shopping_list import rebuild_shopping_lists
+from recipes.similar import update_similar_recipes
+from recipes.trending import update_trending
+
+User = get_user_model()
+
+BATCH_SIZE = 2000
+IMAGE = "recipes/images/benchmark.png"
+HISTORY = timedelta(days=30)
+WORDS = (
+    "суп", "салат", "пирог", "рагу", "каша", "запеканка", "омлет", "паста",
+    "быстрый", "домашний", "летний", "острый", "сырный", "овощной",
+)
+
+
+def bulk_create(model, objects):
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, BATCH_SIZE))
+        if not batch:
+            return
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет базу синтетическими пользователями, рецептами, "
+        "избранным, списками покупок и подписками. При одинаковом --seed "
+        "данные получаются одинаковыми."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--recipes", type=int, default=5000)
+        parser.add_argument("--ingredients-per-recipe", type=int, default=8)
+        parser.add_argument("--favorites-per-user", type=int, default=20)
+        parser.add_argument("--carts-per-user", type=int, default=5)
+        parser.add_argument("--follows-per-user", type=int, default=10)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.prefix = f"bench{options['seed']}_"
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(
+                f"Данные с --seed {options['seed']} уже созданы."
+            )
+
+        started = time.perf_counter()
+        self.now = timezone.now()
+        with transaction.atomic():
+            tag_ids = self.create_tags()
+            ingredient_ids = self.create_ingredients()
+            user_ids = self.create_users(options["users"])
+            recipe_ids = self.create_recipes(
+                user_ids,
+                tag_ids,
+                ingredient_ids,
+                options["recipes"],
+                options["ingredients_per_recipe"],
+            )
+            self.create_relations(
+                Favorite, "recipe", user_ids, recipe_ids,
+                options["favorites_per_user"],
+            )
+            self.create_relations(
+                ShoppingCart, "recipe", user_ids, recipe_ids,
+                options["carts_per_user"],
+            )
+            self.create_relations(
+                Follow, "author", user_ids, user_ids,
+                options["follows_per_user"],
+            )
+            # bulk_create не вызывает сигналы: пересчитываем производные
+            reconcile()
+            rebuild_feed()
+            rebuild_shopping_lists()
+            update_similar_recipes(full=True)
+            update_trending(full=True)
+            rebuild_search_index()
+            for name in (TAGS, INGREDIENTS, RECIPE_INGREDIENTS, FAVORITES):
+                transaction.on_commit(
+                    lambda name=name: bump_data_version(name)
+                )
+
+        self.stdout.write(
+            f"Пользователей: {len(user_ids)}, рецептов: {len(recipe_ids)}, "
+            f"{time.perf_counter() - started:.1f} с"
+        )
+
+    def create_tags(self):
+        for index, (color, _) in enumerate(Tag.COLORS):
+            Tag.objects.get_or_create(
+                color=color,
+                defaults={"name": f"Тег {index}", "slug": f"tag{index}"},
+            )
+        return list(Tag.objects.values_list("id", flat=True))
+
+    def create_ingredients(self):
+        if not Ingredient.objects.exists():
+            units = [unit for unit, _ in Ingredient.MEASURMENTS]
+            bulk_create(
+                Ingredient,
+                (
+                    Ingredient(
+                        name=f"ингредиент {index}",
+                        measurement_unit=self.random.choice(units),
+                    )
+                    for index in range(2000)
+                ),
+            )
+        return list(Ingredient.objects.values_list("id", flat=True))
+
+    def create_users(self, count):
+        password = make_password(self.prefix)
+        bulk_create(
+            User,
+            (
+                User(
+                    username=f"{self.prefix}{index}",
+                    email=f"{self.prefix}{index}@example.com",
+                    first_name="Имя",
+                    last_name="Фамилия",
+                    password=password,
+                )
+                for index in range(count)
+            ),
+        )
+        return list(
+            User.objects.filter(username__startswith=self.prefix)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+    def create_recipes(
+        self, user_ids, tag_ids, ingredient_ids, count, ingredients_count
+    ):
+        last_id = Recipe.objects.order_by("-id").values_list(
+            "id", flat=True
+        ).first() or 0
+        bulk_create(
+            Recipe,
+            (
+                Recipe(
+                    author_id=self.random.choice(user_ids),
+                    name=" ".join(self.random.sample(WORDS, 3)),
+                    image=IMAGE,
+                    text=" ".join(self.random.choices(WORDS, k=40)),
+                    cooking_time=self.random.randint(5, 180),
+                )
+                for _ in range(count)
+            ),
+        )
+        recipe_ids = list(
+            Recipe.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        bulk_create(
+            TagRecipe,
+            (
+                TagRecipe(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in self.random.sample(
+                    tag_ids, self.random.randint(1, min(2, len(tag_ids)))
+                )
+            ),
+        )
+        bulk_create(
+            IngredientRecipe,
+            (
+                IngredientRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500),
+                )
+                for recipe_id in recipe_ids
+                for ingredient_id in self.random.sample(
+                    ingredient_ids, min(ingredients_count, len(ingredient_ids))
+                )
+            ),
+        )
+        return recipe_ids
+
+    def create_relations(self, model, field, user_ids, target_ids, count):
+        bulk_create(
+            model,
+            (
+                model(
+                    user_id=user_id,
+                    **{f"{field}_id": target_id},
+                    **self.event_time(model),
+                )
+                for user_id in user_ids
+                for target_id in self.random.sample(
+                    target_ids, min(count, len(target_ids))
+                )
+                if target_id != user_id or model is not Follow
+            ),
+        )
+
+    def event_time(self, model):
+        # Избранное и списки покупок распределены по последним 30 дням,
+        # чтобы сортировка trending отличалась от сортировки по избранному
+        if model is Follow:
+            return {}
+        seconds = self.random.randrange(int(HISTORY.total_seconds()))
+        return {"created_at": self.now - timedelta(seconds=seconds)}
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from recipes.images import generate_variants, pending_images
+
+
+class Command(BaseCommand):
+    help = (
+        "Создаёт уменьшенные копии и WebP-версии картинок рецептов, которые "
+        "не были созданы после сохранения рецепта."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check-files",
+            action="store_true",
+            help="Пересоздать и копии, файлов которых нет в хранилище.",
+        )
+
+    def handle(self, *args, **options):
+        failed = 0
+        image_names = pending_images(check_files=options["check_files"])
+        for image_name in image_names:
+            try:
+                generate_variants(image_name)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f"{image_name}: {error!r}")
+        self.stdout.write(
+            f"Обработано картинок: {len(image_names) - failed}, "
+            f"с ошибкой: {failed}"
+        )
@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from api.data_version import INGREDIENTS, bump_data_version
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.models import Ingredient
+
+READ_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    """
+    Читает JSON-массив объектов по частям, не загружая файл целиком.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_SIZE).lstrip()
+    if not buffer.startswith("["):
+        raise CommandError("Ожидается JSON-массив ингредиентов.")
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(",").lstrip()
+        if buffer.startswith("]"):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                raise CommandError("Файл JSON обрывается.")
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        yield item["name"], item["measurement_unit"]
+
+
+READERS = {
+    "csv": read_csv,
+    "json": read_json,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает ингредиенты из CSV (название, единица измерения) или "
+        "JSON. Уже существующие ингредиенты пропускаются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=Path)
+        parser.add_argument("--format", choices=READERS, default=None)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--no-copy",
+            action="store_true",
+            help="Не использовать COPY на PostgreSQL.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or path.suffix.lstrip(".").lower()
+        if file_format not in READERS:
+            raise CommandError(f"Неизвестный формат файла: {path}")
+        use_copy = connection.vendor == "postgresql" and not options["no_copy"]
+        units = {unit for unit, _ in Ingredient.MEASURMENTS}
+
+        started = time.perf_counter()
+        read = skipped = 0
+        before = Ingredient.objects.count()
+        with open(path, encoding="utf-8") as file, transaction.atomic():
+            rows = READERS[file_format](file)
+            while True:
+                batch = []
+                for name, unit in islice(rows, options["batch_size"]):
+                    read += 1
+                    name, unit = name.strip().lower(), unit.strip()
+                    if not name or unit not in units:
+                        skipped += 1
+                        continue
+                    batch.append((name, unit))
+                if not batch:
+                    break
+                if use_copy:
+                    self.copy_batch(batch)
+                else:
+                    self.insert_batch(batch)
+            transaction.on_commit(lambda: bump_data_version(INGREDIENTS))
+
+        elapsed = time.perf_counter() - started
+        inserted = Ingredient.objects.count() - before
+        self.stdout.write(
+            f"Прочитано: {read}, добавлено: {inserted}, "
+            f"пропущено: {skipped}, {elapsed:.2f} с "
+            f"({read / elapsed if elapsed else 0:.0f} строк/с)"
+        )
+
+    def insert_batch(self, batch):
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=name, measurement_unit=unit)
+                for name, unit in batch
+            ],
+            ignore_conflicts=True,
+        )
+
+    def copy_batch(self, batch):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS ingredient_load "
+                "(name varchar(200), measurement_unit varchar(20)) "
+                "ON COMMIT DROP"
+            )
+            cursor.cursor.copy_expert(
+                "COPY ingredient_load FROM STDIN WITH (FORMAT csv)", buffer
+            )
+            cursor.execute(
+                f"INSERT INTO {table} (name, measurement_unit) "
+                "SELECT DISTINCT name, measurement_unit FROM ingredient_load "
+                "ON CONFLICT DO NOTHING"
+            )
+            cursor.execute("TRUNCATE ingredient_load")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.feed import rebuild_feed
+from recipes.models import FeedEntry
+
+
+class Command(BaseCommand):
+    help = "Пересобирает ленту подписок по текущим подпискам и рецептам."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_feed()
+        self.stdout.write(
+            f"Записей в ленте: {FeedEntry.objects.count()}"
+        )
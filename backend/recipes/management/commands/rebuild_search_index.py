@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.search import rebuild_search_index, setup_search
+
+
+class Command(BaseCommand):
+    help = "Создаёт и заново заполняет поисковый индекс рецептов."
+
+    def handle(self, *args, **options):
+        setup_search()
+        with transaction.atomic():
+            rebuild_search_index()
+        self.stdout.write("Поисковый индекс пересобран.")
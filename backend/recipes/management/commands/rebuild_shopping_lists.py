@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import ShoppingListItem
+from recipes.shopping_list import rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает списки покупок пользователей по текущим спискам и "
+        "ингредиентам рецептов."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_shopping_lists()
+        self.stdout.write(
+            f"Строк в списках покупок: {ShoppingListItem.objects.count()}"
+        )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает счётчики избранного, списков покупок, рецептов "
+        "и подписчиков и исправляет расхождения."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = reconcile()
+        for counter, count in fixed.items():
+            self.stdout.write(f"{counter}: исправлено {count}")
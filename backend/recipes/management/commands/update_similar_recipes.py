@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.similar import update_similar_recipes
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает похожие рецепты для рецептов, изменённых с прошлого "
+        "запуска, и рецептов, на которые эти изменения влияют."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Пересчитать похожие рецепты для всех рецептов.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = update_similar_recipes(full=options["full"])
+        self.stdout.write(f"Пересчитано рецептов: {count}")
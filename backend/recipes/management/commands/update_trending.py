@@ -0,0 +1,28 @@
+from api.data_version import FAVORITES, bump_data_version
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.trending import update_trending
+
+
+class Command(BaseCommand):
+    help = (
+        "Добавляет к популярности рецептов (сортировка trending) события "
+        "избранного и списков покупок с прошлого запуска."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Пересчитать популярность всех рецептов по всем событиям.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            events = update_trending(full=options["full"])
+            if events or options["full"]:
+                # Сбрасывает кеш и ETag списков с сортировкой
+                transaction.on_commit(
+                    lambda: bump_data_version(FAVORITES)
+                )
+        self.stdout.write(f"Обработано событий: {events}")
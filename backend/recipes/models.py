@@ -1,6 +1,10 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
+
+from .storage import ContentHashStorage
 
 User = get_user_model()
 
@@ -110,8 +114,14 @@ class Recipe(models.Model):
     name = models.CharField(max_length=200, verbose_name="Название")
     image = models.ImageField(
         upload_to="recipes/images/",
+        storage=ContentHashStorage(),
         verbose_name="Картинка"
     )
+    image_variants = models.JSONField(
+        default=dict,
+        editable=False,
+        verbose_name="Уменьшенные копии картинки",
+    )
     text = models.TextField(
         max_length=400,
         verbose_name="Текстовое описание",
@@ -125,18 +135,52 @@ class Recipe(models.Model):
             ),
         ]
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="В избранном",
+    )
+    shopping_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="В списках покупок",
+    )
+    # Популярность с затуханием во времени, считается recipes.trending
+    trending_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name="Популярность сейчас",
+    )
+    # Заполняется на PostgreSQL, GIN-индекс создаётся в recipes.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name="Дата создания"
+    )
+    # Меняется при каждом сохранении рецепта. Теги и ингредиенты меняются
+    # только вместе с рецептом (сериализатор и админка сохраняют и его),
+    # поэтому их изменения тоже сдвигают updated_at.
+    updated_at = models.DateTimeField(
+        auto_now=True, verbose_name="Дата изменения"
+    )
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ["-id"]
+        indexes = [
+            models.Index(
+                fields=["-favorites_count", "-id"],
+                name="recipe_favorites_count",
+            ),
+            models.Index(
+                fields=["-trending_score", "-id"],
+                name="recipe_trending_score",
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
-    def favorite_count(self):
-        return self.favorite_recipe.count()
-
 
 class TagRecipe(models.Model):
     tag = models.ForeignKey(
@@ -209,6 +253,13 @@ class Favorite(models.Model):
         related_name="favorite_recipe",
         verbose_name="Рецепт",
     )
+    # Время события нужно для сортировки trending (recipes.trending)
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        db_index=True,
+        verbose_name="Дата добавления",
+    )
 
     class Meta:
         constraints = [
@@ -231,6 +282,13 @@ class ShoppingCart(models.Model):
         related_name="shopping_cart_recipe",
         verbose_name="Рецепт",
     )
+    # Время события нужно для сортировки trending (recipes.trending)
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        db_index=True,
+        verbose_name="Дата добавления",
+    )
 
     class Meta:
         constraints = [
@@ -240,6 +298,47 @@ class ShoppingCart(models.Model):
         ]
 
 
+class ShoppingListItem(models.Model):
+    """
+    Строка списка покупок: суммарное количество ингредиента во всех
+    рецептах из списка покупок пользователя. Обновляется при добавлении и
+    удалении рецептов из списка и при изменении их ингредиентов
+    (recipes.shopping_list). Строки с recipes_count = 0 не удаляются, а
+    пропускаются при чтении.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_user",
+        verbose_name="Пользователь",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_ingredient",
+        verbose_name="Ингредиент",
+    )
+    amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        verbose_name="Количество",
+    )
+    recipes_count = models.IntegerField(
+        default=0, verbose_name="Рецептов с ингредиентом"
+    )
+
+    class Meta:
+        verbose_name = "Строка списка покупок"
+        verbose_name_plural = "Списки покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"], name="unique shopping list item"
+            )
+        ]
+
+
 class Follow(models.Model):
     user = models.ForeignKey(
         User,
@@ -260,3 +359,89 @@ class Follow(models.Model):
                 fields=["user", "author"], name="unique follow"
             )
         ]
+
+
+class FeedEntry(models.Model):
+    """
+    Запись ленты подписок: рецепт автора, на которого подписан пользователь.
+    Заполняется при публикации рецепта и при подписке на автора.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="feed_user",
+        verbose_name="Подписчик",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="feed_recipe",
+        verbose_name="Рецепт",
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="feed_author",
+        verbose_name="Автор",
+    )
+
+    class Meta:
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Лента подписок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"], name="unique feed entry"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["user", "author"], name="feed_user_author"),
+        ]
+
+
+class SimilarRecipe(models.Model):
+    """
+    Похожий рецепт: один из ближайших к recipe по ингредиентам и тегам.
+    Заполняется командой update_similar_recipes (recipes.similar).
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="similar_recipe",
+        verbose_name="Рецепт",
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="similar_to",
+        verbose_name="Похожий рецепт",
+    )
+    score = models.FloatField(verbose_name="Сходство")
+
+    class Meta:
+        verbose_name = "Похожий рецепт"
+        verbose_name_plural = "Похожие рецепты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recipe", "similar"], name="unique similar recipe"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["recipe", "-score"], name="similar_recipe_score"
+            ),
+        ]
+
+
+class Watermark(models.Model):
+    """
+    Время, до которого периодическая задача name уже обработала данные.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    value = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Отметка периодической задачи"
+        verbose_name_plural = "Отметки периодических задач"
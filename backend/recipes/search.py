@@ -0,0 +1,135 @@
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connections
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe
+
+CONFIG = "russian"
+FTS_TABLE = "recipes_recipe_fts"
+
+
+def search_vector():
+    return SearchVector("name", weight="A", config=CONFIG) + SearchVector(
+        "text", weight="B", config=CONFIG
+    )
+
+
+def setup_search(using="default", **kwargs):
+    """
+    Создаёт поисковый индекс: GIN-индекс по search_vector на PostgreSQL
+    или виртуальную таблицу FTS5 на SQLite. Вызывается после migrate.
+    """
+    connection = connections[using]
+    table = Recipe._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS recipe_search_vector "
+                f"ON {table} USING gin (search_vector)"
+            )
+        elif connection.vendor == "sqlite":
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                "USING fts5(name, text)"
+            )
+
+
+def index_recipes(queryset):
+    """
+    Обновляет поисковый индекс для рецептов из queryset.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql":
+        queryset.update(search_vector=search_vector())
+    elif connection.vendor == "sqlite":
+        rows = list(queryset.values_list("id", "name", "text"))
+        _write_fts(connection, rows)
+
+
+def index_recipe(recipe):
+    """
+    Обновляет поисковый индекс для сохранённого рецепта. На SQLite название
+    и описание берутся из recipe, без повторного чтения рецепта.
+    """
+    using = recipe._state.db or "default"
+    if connections[using].vendor == "sqlite":
+        _write_fts(
+            connections[using], [(recipe.pk, recipe.name, recipe.text)]
+        )
+    else:
+        index_recipes(Recipe.objects.using(using).filter(pk=recipe.pk))
+
+
+def _write_fts(connection, rows):
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+            [(pk,) for pk, _, _ in rows],
+        )
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, text) "
+            "VALUES (%s, %s, %s)",
+            rows,
+        )
+
+
+def unindex_recipe(recipe, using="default"):
+    connection = connections[using]
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [recipe.pk]
+            )
+
+
+def rebuild_search_index(using="default"):
+    connection = connections[using]
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+    index_recipes(Recipe.objects.using(using).all())
+
+
+def _fts_query(term):
+    # Каждое слово ищется как префикс; кавычки экранируют синтаксис FTS5
+    words = term.replace('"', '""').split()
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_recipes(queryset, term):
+    """
+    Оставляет в queryset рецепты, подходящие под term, и сортирует их по
+    релевантности: сначала совпадения в названии, затем в описании.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql":
+        query = SearchQuery(term, config=CONFIG, search_type="websearch")
+        return (
+            queryset.filter(search_vector=query)
+            .annotate(search_rank=SearchRank(F("search_vector"), query))
+            .order_by("-search_rank", "-id")
+        )
+    if connection.vendor == "sqlite":
+        fts_query = _fts_query(term)
+        if not fts_query:
+            return queryset
+        # Совпадения и их ранг выбираются подзапросами к FTS5 в том же
+        # запросе, поэтому пагинация и фильтры работают по всем совпадениям
+        column = ".".join(
+            map(connection.ops.quote_name, (Recipe._meta.db_table, "id"))
+        )
+        match = f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+        rank = RawSQL(
+            f"SELECT bm25({FTS_TABLE}, 10.0, 1.0) {match} "
+            f"AND rowid = {column}",
+            [fts_query],
+        )
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid {match}", [fts_query])
+        ).order_by(rank, "-id")
+    return queryset.filter(name__icontains=term)
@@ -0,0 +1,154 @@
+from django.db.models import (
+    Case,
+    Count,
+    DecimalField,
+    F,
+    IntegerField,
+    Sum,
+    Value,
+    When,
+)
+
+from .models import IngredientRecipe, ShoppingCart, ShoppingListItem
+
+BATCH_SIZE = 1000
+
+
+def _bulk_create(items):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= BATCH_SIZE:
+            ShoppingListItem.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        ShoppingListItem.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def recipe_deltas(recipe_ids, sign=1):
+    """
+    Изменения списка покупок от добавления (sign = 1) или удаления
+    (sign = -1) рецептов recipe_ids: {ingredient_id: (amount, recipes)}.
+    """
+    rows = (
+        IngredientRecipe.objects.filter(recipe_id__in=recipe_ids)
+        .order_by()
+        .values("ingredient_id")
+        .annotate(total=Sum("amount"), recipes=Count("pk"))
+        .values_list("ingredient_id", "total", "recipes")
+    )
+    return {
+        ingredient_id: (sign * total, sign * recipes)
+        for ingredient_id, total, recipes in rows
+    }
+
+
+def amount_deltas(old_amounts, new_amounts):
+    """
+    Изменения списка покупок от замены ингредиентов рецепта: old_amounts и
+    new_amounts - словари {ingredient_id: amount}.
+    """
+    deltas = {}
+    for ingredient_id in old_amounts.keys() | new_amounts.keys():
+        old = old_amounts.get(ingredient_id)
+        new = new_amounts.get(ingredient_id)
+        if old == new:
+            continue
+        deltas[ingredient_id] = (
+            (new or 0) - (old or 0),
+            (new is not None) - (old is not None),
+        )
+    return deltas
+
+
+def apply_deltas(user_ids, deltas):
+    """
+    Прибавляет deltas к спискам покупок пользователей user_ids: недостающие
+    строки создаются, а все изменения записываются одним UPDATE.
+    """
+    if not user_ids or not deltas:
+        return
+    added = [pk for pk, (_, recipes) in deltas.items() if recipes > 0]
+    _bulk_create(
+        ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id)
+        for user_id in user_ids
+        for ingredient_id in added
+    )
+    amounts = Case(
+        *(
+            When(ingredient_id=pk, then=Value(amount))
+            for pk, (amount, _) in deltas.items()
+        ),
+        default=Value(0),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    recipes = Case(
+        *(
+            When(ingredient_id=pk, then=Value(count))
+            for pk, (_, count) in deltas.items()
+        ),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas
+    ).update(
+        amount=F("amount") + amounts,
+        recipes_count=F("recipes_count") + recipes,
+    )
+
+
+def add_recipes(user_id, recipe_ids):
+    apply_deltas([user_id], recipe_deltas(recipe_ids))
+
+
+def remove_recipes(user_id, recipe_ids):
+    apply_deltas([user_id], recipe_deltas(recipe_ids, sign=-1))
+
+
+def change_recipe(recipe_id, deltas):
+    """
+    Применяет изменения ингредиентов рецепта к спискам покупок всех
+    пользователей, у которых он в списке.
+    """
+    if not deltas:
+        return
+    users = ShoppingCart.objects.filter(recipe_id=recipe_id).values_list(
+        "user_id", flat=True
+    )
+    batch = []
+    for user_id in users.iterator(chunk_size=BATCH_SIZE):
+        batch.append(user_id)
+        if len(batch) >= BATCH_SIZE:
+            apply_deltas(batch, deltas)
+            batch = []
+    apply_deltas(batch, deltas)
+
+
+def rebuild_shopping_lists():
+    ShoppingListItem.objects.all().delete()
+    rows = (
+        IngredientRecipe.objects.filter(
+            recipe__shopping_cart_recipe__isnull=False
+        )
+        .order_by()
+        .values("recipe__shopping_cart_recipe__user_id", "ingredient_id")
+        .annotate(total=Sum("amount"), recipes=Count("pk"))
+        .values_list(
+            "recipe__shopping_cart_recipe__user_id",
+            "ingredient_id",
+            "total",
+            "recipes",
+        )
+    )
+    _bulk_create(
+        ShoppingListItem(
+            user_id=user_id,
+            ingredient_id=ingredient_id,
+            amount=total,
+            recipes_count=recipes,
+        )
+        for user_id, ingredient_id, total, recipes in rows.iterator(
+            chunk_size=BATCH_SIZE
+        )
+    )
@@ -0,0 +1,71 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from . import feed, images, search, shopping_list
+from .counters import increment
+from .models import Favorite, Follow, Recipe, ShoppingCart
+
+User = get_user_model()
+
+# Состав рецепта записан: отправляется сериализатором и админкой, которые
+# сохраняют ингредиенты рецепта, с аргументами recipe_id и ingredient_ids
+recipe_ingredients_saved = Signal()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    if created:
+        increment(User, instance.author_id, "recipes_count")
+        feed.fan_out_recipe(instance)
+    images.schedule_variants(instance)
+    search.index_recipe(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    increment(User, instance.author_id, "recipes_count", -1)
+    search.unindex_recipe(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        increment(User, instance.author_id, "followers_count")
+        feed.backfill_follow(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    increment(User, instance.author_id, "followers_count", -1)
+    feed.prune_follow(instance)
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_saved(sender, instance, created, **kwargs):
+    if created:
+        increment(Recipe, instance.recipe_id, "favorites_count")
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_deleted(sender, instance, **kwargs):
+    increment(Recipe, instance.recipe_id, "favorites_count", -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_saved(sender, instance, created, **kwargs):
+    if created:
+        increment(Recipe, instance.recipe_id, "shopping_carts_count")
+        shopping_list.add_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def shopping_cart_deleting(sender, instance, **kwargs):
+    # До удаления: при удалении рецепта его ингредиенты удаляются каскадом
+    # и после удаления строки списка их уже может не быть
+    shopping_list.remove_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def shopping_cart_deleted(sender, instance, **kwargs):
+    increment(Recipe, instance.recipe_id, "shopping_carts_count", -1)
@@ -0,0 +1,255 @@
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Count, Min
+from django.utils import timezone
+from scipy import sparse
+
+from .models import IngredientRecipe, Recipe, SimilarRecipe, TagRecipe
+from .watermarks import get_watermark, set_watermark
+
+NEIGHBOURS = 10
+# Общий тег весит меньше общего ингредиента: тегов мало, и они есть
+# почти у всех рецептов
+TAG_WEIGHT = 0.5
+BATCH_SIZE = 1000
+# Наибольшее число пар рецептов в одном блоке произведения матриц
+CHUNK_CELLS = 2 ** 22
+WATERMARK = "similar_recipes"
+# Рецепты, сохранённые незадолго до запуска, могли попасть в базу уже
+# после чтения данных: такие рецепты пересчитываются ещё раз
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+class SimilarityIndex:
+    """
+    Ингредиенты и теги рецептов в памяти процесса: разреженные матрицы
+    рецептов и ингредиентов и рецептов и тегов (CSR), строка - рецепт из
+    recipe_ids.
+
+    Сходство - взвешенный коэффициент Жаккара по множествам ингредиентов и
+    тегов. Общие ингредиенты рецептов блока со всеми рецептами - произведение
+    строк блока на транспонированную матрицу: в результате есть только
+    пары с общими ингредиентами, и только для них считаются общие теги и
+    сходство. Блок ограничен CHUNK_CELLS парами рецептов, поэтому память не
+    растёт с квадратом числа рецептов.
+    """
+
+    def __init__(self):
+        ingredients = self._pairs(
+            IngredientRecipe.objects.values_list("recipe_id", "ingredient_id")
+        )
+        tags = self._pairs(
+            TagRecipe.objects.values_list("recipe_id", "tag_id")
+        )
+        self.recipe_ids = np.unique(
+            np.concatenate((ingredients[:, 0], tags[:, 0]))
+        )
+        self.ingredients = self._matrix(ingredients)
+        self.tags = self._matrix(tags)
+        self.ingredients_t = self.ingredients.T.tocsr()
+        self.tags_t = self.tags.T.tocsr()
+        self.weights = (
+            np.asarray(self.ingredients.sum(axis=1)).ravel()
+            + TAG_WEIGHT * np.asarray(self.tags.sum(axis=1)).ravel()
+        )
+
+    @staticmethod
+    def _pairs(rows):
+        return np.array(
+            list(rows.iterator(chunk_size=BATCH_SIZE)), dtype=np.int64
+        ).reshape(-1, 2)
+
+    def _matrix(self, pairs):
+        columns, column_ids = np.unique(pairs[:, 1], return_inverse=True)
+        return sparse.csr_matrix(
+            (
+                np.ones(len(pairs)),
+                (np.searchsorted(self.recipe_ids, pairs[:, 0]), column_ids),
+            ),
+            shape=(len(self.recipe_ids), len(columns)),
+        )
+
+    def _scores(self, rows):
+        """
+        Сходство рецептов строк rows с рецептами, у которых есть общие с
+        ними ингредиенты: разреженная матрица len(rows) x len(recipe_ids).
+        """
+        shared = self.ingredients[rows] @ self.ingredients_t
+        shared.sort_indices()
+        own = rows[np.repeat(np.arange(len(rows)), np.diff(shared.indptr))]
+        other = shared.indices
+        common = shared.data + TAG_WEIGHT * np.asarray(
+            self.tags[own].multiply(self.tags[other]).sum(axis=1)
+        ).ravel()
+        data = common / (self.weights[own] + self.weights[other] - common)
+        data[own == other] = 0
+        scores = sparse.csr_matrix(
+            (data, shared.indices, shared.indptr), shape=shared.shape
+        )
+        scores.eliminate_zeros()
+        return scores
+
+    def _chunks(self, recipe_ids):
+        """
+        Строки recipe_ids и их сходство с остальными рецептами блоками не
+        больше CHUNK_CELLS пар рецептов.
+        """
+        rows = np.flatnonzero(np.isin(self.recipe_ids, list(recipe_ids)))
+        size = max(1, CHUNK_CELLS // max(1, len(self.recipe_ids)))
+        for start in range(0, len(rows), size):
+            chunk = rows[start:start + size]
+            yield chunk, self._scores(chunk)
+
+    def neighbours(self, recipe_ids):
+        """
+        NEIGHBOURS самых похожих рецептов для каждого из recipe_ids:
+        (id рецепта, id похожего, сходство).
+        """
+        for rows, scores in self._chunks(recipe_ids):
+            chunk_rows, columns, values = _top(scores, NEIGHBOURS)
+            yield from zip(
+                self.recipe_ids[rows[chunk_rows]].tolist(),
+                self.recipe_ids[columns].tolist(),
+                values.tolist(),
+            )
+
+    def best_scores(self, recipe_ids):
+        """
+        Наибольшее сходство рецептов с рецептами recipe_ids: {id рецепта:
+        сходство} для рецептов с общими с ними ингредиентами.
+        """
+        best = np.zeros(len(self.recipe_ids))
+        for _, scores in self._chunks(recipe_ids):
+            np.maximum(best, scores.max(axis=0).toarray().ravel(), out=best)
+        found = np.flatnonzero(best)
+        return dict(
+            zip(self.recipe_ids[found].tolist(), best[found].tolist())
+        )
+
+
+def _top(scores, count):
+    """
+    count наибольших значений каждой строки разреженной матрицы scores:
+    строки, столбцы и значения, по убыванию значения, при равных - по
+    возрастанию столбца (меньшего id рецепта).
+    """
+    lengths = np.diff(scores.indptr)
+    width = lengths.max(initial=0)
+    count = min(count, width)
+    if not count:
+        empty = np.empty(0, dtype=int)
+        return empty, empty, np.empty(0)
+    # Строки дополняются нулями до самой длинной: значения каждой строки
+    # идут по возрастанию столбца
+    row_of = np.repeat(np.arange(len(lengths)), lengths)
+    position = np.arange(scores.nnz) - scores.indptr[row_of]
+    values = np.zeros((len(lengths), width))
+    values[row_of, position] = scores.data
+    columns = np.zeros((len(lengths), width), dtype=scores.indices.dtype)
+    columns[row_of, position] = scores.indices
+    top = np.argpartition(-values, count - 1, axis=1)[:, :count]
+    # Из значений, равных наименьшему из count наибольших, argpartition
+    # берёт произвольные: вместо них берутся первые по столбцу
+    threshold = np.take_along_axis(values, top, axis=1).min(axis=1)
+    above = values > threshold[:, np.newaxis]
+    ties = values == threshold[:, np.newaxis]
+    free = count - above.sum(axis=1)
+    chosen = (
+        above | (ties & (np.cumsum(ties, axis=1) <= free[:, np.newaxis]))
+    ) & (values > 0)
+    rows, positions = np.nonzero(chosen)
+    columns = columns[rows, positions]
+    values = values[rows, positions]
+    order = np.lexsort((columns, -values, rows))
+    return rows[order], columns[order], values[order]
+
+
+def _write(index, recipe_ids):
+    """
+    Заменяет похожие рецепты для recipe_ids пачками по BATCH_SIZE.
+    """
+    recipe_ids = sorted(recipe_ids)
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        SimilarRecipe.objects.filter(recipe_id__in=batch).delete()
+        SimilarRecipe.objects.bulk_create(
+            SimilarRecipe(
+                recipe_id=recipe_id, similar_id=other_id, score=score
+            )
+            for recipe_id, other_id, score in index.neighbours(batch)
+        )
+
+
+def _thresholds(recipe_ids):
+    """
+    Число сохранённых похожих рецептов и наименьшее сходство среди них для
+    каждого из recipe_ids.
+    """
+    recipe_ids = list(recipe_ids)
+    thresholds = {}
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        rows = (
+            SimilarRecipe.objects.filter(
+                recipe_id__in=recipe_ids[start:start + BATCH_SIZE]
+            )
+            .order_by()
+            .values("recipe_id")
+            .annotate(count=Count("pk"), low=Min("score"))
+            .values_list("recipe_id", "count", "low")
+        )
+        thresholds.update(
+            (recipe_id, (count, low)) for recipe_id, count, low in rows
+        )
+    return thresholds
+
+
+def affected_recipes(index, edited_ids):
+    """
+    Рецепты, списки похожих которых могли измениться из-за правки
+    edited_ids: сами изменённые рецепты, рецепты, в списках которых они уже
+    есть, и рецепты, в списки которых они теперь проходят по сходству.
+    """
+    affected = set(edited_ids)
+    affected.update(
+        SimilarRecipe.objects.filter(similar_id__in=edited_ids).values_list(
+            "recipe_id", flat=True
+        )
+    )
+    candidates = {
+        other_id: score
+        for other_id, score in index.best_scores(edited_ids).items()
+        if other_id not in affected
+    }
+    thresholds = _thresholds(candidates)
+    for other_id, score in candidates.items():
+        count, low = thresholds.get(other_id, (0, 0))
+        if count < NEIGHBOURS or score >= low:
+            affected.add(other_id)
+    return affected
+
+
+def update_similar_recipes(full=False):
+    """
+    Пересчитывает похожие рецепты: все или только затронутые рецептами,
+    изменёнными с прошлого запуска. Возвращает число пересчитанных
+    рецептов.
+
+    Удалённый рецепт пропадает из чужих списков каскадом, и до полного
+    пересчёта в них остаётся на один рецепт меньше.
+    """
+    started = timezone.now()
+    watermark = get_watermark(WATERMARK)
+    index = SimilarityIndex()
+    if full or watermark is None:
+        affected = set(Recipe.objects.values_list("id", flat=True))
+    else:
+        edited_ids = list(
+            Recipe.objects.filter(
+                updated_at__gte=watermark - WATERMARK_OVERLAP
+            ).values_list("id", flat=True)
+        )
+        affected = affected_recipes(index, edited_ids)
+    _write(index, affected)
+    set_watermark(WATERMARK, started)
+    return len(affected)
@@ -0,0 +1,25 @@
+import os
+from hashlib import sha256
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+    """
+    Хранилище, в котором имя файла - хеш его содержимого. Одинаковые
+    загрузки сохраняются на диск один раз и получают одно и то же имя.
+    """
+
+    def save(self, name, content, max_length=None):
+        digest = sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, digest.hexdigest() + extension)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
@@ -0,0 +1,436 @@
+import base64
+import os
+import shutil
+import tempfile
+from concurrent.futures import Future
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from users.models import User
+
+from . import (
+    counters,
+    feed,
+    images,
+    models,
+    search,
+    shopping_list,
+    similar,
+    trending,
+)
+
+MEDIA_ROOT = tempfile.mkdtemp()
+GIF = base64.b64decode(
+    "R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw=="
+)
+
+
+class RecipeData:
+    """
+    Пользователи, теги, ингредиенты и рецепты с пересекающимися составами.
+    Связи создаются через модели, поэтому производные данные обновляются
+    сигналами, как в приложении.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                f"user{i}", f"user{i}@example.com", "password",
+                first_name="Иван", last_name="Иванов",
+            )
+            for i in range(3)
+        ]
+        cls.tags = [
+            models.Tag.objects.create(
+                name=f"Тег {i}", color=f"#00000{i}", slug=f"tag{i}"
+            )
+            for i in range(2)
+        ]
+        cls.ingredients = [
+            models.Ingredient.objects.create(
+                name=f"Ингредиент {i}", measurement_unit="г"
+            )
+            for i in range(8)
+        ]
+        cls.recipes = [
+            cls.create_recipe(
+                cls.users[i % len(cls.users)],
+                cls.ingredients[i % 5:i % 5 + 3],
+                cls.tags[:i % 2 + 1],
+                amount=i + 1,
+            )
+            for i in range(10)
+        ]
+
+    @classmethod
+    def create_recipe(cls, author, ingredients, tags, amount=1):
+        recipe = models.Recipe.objects.create(
+            author=author,
+            name="Рецепт",
+            image="recipes/images/recipe.gif",
+            text="Описание",
+            cooking_time=10,
+        )
+        recipe.tags.set(tags)
+        models.IngredientRecipe.objects.bulk_create(
+            models.IngredientRecipe(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+            for ingredient in ingredients
+        )
+        return recipe
+
+
+class ShoppingListTest(RecipeData, APITestCase):
+    def assert_matches_rebuild(self):
+        # Строки с recipes_count = 0 не удаляются, а пропускаются при чтении
+        items = models.ShoppingListItem.objects.filter(
+            recipes_count__gt=0
+        ).values_list("user_id", "ingredient_id", "amount", "recipes_count")
+        incremental = set(items)
+        self.assertTrue(incremental)
+        shopping_list.rebuild_shopping_lists()
+        self.assertEqual(incremental, set(items.all()))
+
+    def add_to_carts(self):
+        carts = {
+            self.users[0]: self.recipes[:6],
+            self.users[1]: self.recipes[3:],
+        }
+        for user, recipes in carts.items():
+            for recipe in recipes:
+                models.ShoppingCart.objects.create(user=user, recipe=recipe)
+
+    def test_add_and_remove(self):
+        self.add_to_carts()
+        self.assert_matches_rebuild()
+        models.ShoppingCart.objects.filter(
+            user=self.users[0], recipe__in=self.recipes[:2]
+        ).delete()
+        models.ShoppingCart.objects.get(
+            user=self.users[1], recipe=self.recipes[4]
+        ).delete()
+        self.assert_matches_rebuild()
+
+    def test_bulk_add_and_remove(self):
+        user = self.users[2]
+        recipe_ids = [recipe.id for recipe in self.recipes[2:7]]
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            "/api/recipes/shopping_cart/bulk/",
+            {"ids": recipe_ids},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assert_matches_rebuild()
+        response = self.client.delete(
+            "/api/recipes/shopping_cart/bulk/",
+            {"ids": recipe_ids[:3]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assert_matches_rebuild()
+
+    def test_ingredient_edit(self):
+        self.add_to_carts()
+        recipe = self.recipes[4]
+        # Количество первого ингредиента меняется, остальные удаляются,
+        # добавляется новый
+        kept = recipe.ingredients.order_by("ingredient_id").first()
+        ingredients = [
+            {"id": kept.ingredient_id, "amount": kept.amount + 5},
+            {"id": self.ingredients[7].id, "amount": 3},
+        ]
+        self.client.force_authenticate(recipe.author)
+        response = self.client.patch(
+            f"/api/recipes/{recipe.id}/",
+            {
+                "ingredients": ingredients,
+                "tags": [tag.id for tag in self.tags],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assert_matches_rebuild()
+
+    def test_recipe_deletion(self):
+        self.add_to_carts()
+        self.recipes[4].delete()
+        self.assert_matches_rebuild()
+
+
+class FeedTest(RecipeData, APITestCase):
+    def assert_matches_rebuild(self):
+        entries = models.FeedEntry.objects.values_list(
+            "user_id", "recipe_id", "author_id"
+        )
+        incremental = set(entries)
+        self.assertTrue(incremental)
+        feed.rebuild_feed()
+        self.assertEqual(incremental, set(entries.all()))
+
+    def test_follow_and_unfollow(self):
+        user, first, second = self.users
+        models.Follow.objects.create(user=user, author=first)
+        follow = models.Follow.objects.create(user=user, author=second)
+        models.Follow.objects.create(user=second, author=first)
+        self.assert_matches_rebuild()
+        follow.delete()
+        self.assert_matches_rebuild()
+
+    def test_bulk_follow_and_unfollow(self):
+        user = self.users[0]
+        author_ids = [author.id for author in self.users[1:]]
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            "/api/users/subscribe/bulk/", {"ids": author_ids}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assert_matches_rebuild()
+        response = self.client.delete(
+            "/api/users/subscribe/bulk/",
+            {"ids": author_ids[:1]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assert_matches_rebuild()
+
+    def test_new_and_deleted_recipes(self):
+        user, author, _ = self.users
+        models.Follow.objects.create(user=user, author=author)
+        self.create_recipe(author, self.ingredients[:2], self.tags[:1])
+        self.assert_matches_rebuild()
+        models.Recipe.objects.filter(author=author).first().delete()
+        self.assert_matches_rebuild()
+
+
+class CountersTest(RecipeData, APITestCase):
+    def assert_counters_match(self):
+        self.assertEqual(set(counters.reconcile().values()), {0})
+
+    def test_single_changes(self):
+        user, author, _ = self.users
+        for recipe in self.recipes[:4]:
+            models.Favorite.objects.create(user=user, recipe=recipe)
+            models.ShoppingCart.objects.create(user=author, recipe=recipe)
+        models.Follow.objects.create(user=user, author=author)
+        self.create_recipe(author, self.ingredients[:2], self.tags[:1])
+        self.assert_counters_match()
+        models.Favorite.objects.filter(recipe=self.recipes[0]).delete()
+        models.Follow.objects.filter(user=user).delete()
+        self.recipes[1].delete()
+        self.assert_counters_match()
+
+    def test_bulk_changes(self):
+        user = self.users[0]
+        recipe_ids = [recipe.id for recipe in self.recipes[:6]]
+        author_ids = [author.id for author in self.users[1:]]
+        self.client.force_authenticate(user)
+        requests = (
+            ("/api/recipes/favorite/bulk/", recipe_ids),
+            ("/api/recipes/shopping_cart/bulk/", recipe_ids),
+            ("/api/users/subscribe/bulk/", author_ids),
+        )
+        for url, ids in requests:
+            response = self.client.post(url, {"ids": ids}, format="json")
+            self.assertEqual(response.status_code, 200)
+        self.assert_counters_match()
+        for url, ids in requests:
+            response = self.client.delete(
+                url, {"ids": ids[:2]}, format="json"
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assert_counters_match()
+
+    def test_reconcile_fixes_drift(self):
+        models.Favorite.objects.create(
+            user=self.users[0], recipe=self.recipes[0]
+        )
+        models.Recipe.objects.filter(pk=self.recipes[0].pk).update(
+            favorites_count=5
+        )
+        self.assertEqual(counters.reconcile()["Recipe.favorites_count"], 1)
+        self.recipes[0].refresh_from_db()
+        self.assertEqual(self.recipes[0].favorites_count, 1)
+        self.assert_counters_match()
+
+
+class SimilarRecipesTest(RecipeData, APITestCase):
+    def setUp(self):
+        # Списки короче числа рецептов, чтобы правка затрагивала не все
+        patcher = mock.patch.object(similar, "NEIGHBOURS", 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        similar.update_similar_recipes(full=True)
+        # Рецепты изменены давно: следующий запуск пересчитает только
+        # затронутые правками теста
+        models.Recipe.objects.update(
+            updated_at=timezone.now() - timedelta(days=1)
+        )
+
+    def assert_matches_full(self):
+        rows = models.SimilarRecipe.objects.values_list(
+            "recipe_id", "similar_id", "score"
+        )
+        updated = similar.update_similar_recipes()
+        self.assertLess(updated, models.Recipe.objects.count())
+        incremental = {(*row[:2], round(row[2], 6)) for row in rows}
+        similar.update_similar_recipes(full=True)
+        self.assertEqual(
+            incremental, {(*row[:2], round(row[2], 6)) for row in rows.all()}
+        )
+
+    def test_ingredient_edit(self):
+        recipe = self.recipes[0]
+        recipe.ingredients.all().delete()
+        models.IngredientRecipe.objects.bulk_create(
+            models.IngredientRecipe(
+                recipe=recipe, ingredient=ingredient, amount=1
+            )
+            for ingredient in self.ingredients[5:]
+        )
+        recipe.save()
+        self.assert_matches_full()
+
+    def test_new_recipe(self):
+        self.create_recipe(self.users[0], self.ingredients[1:4], self.tags)
+        self.assert_matches_full()
+
+
+class TrendingTest(RecipeData, APITestCase):
+    def add_events(self, user, recipes, now, step):
+        for number, recipe in enumerate(recipes, start=1):
+            favorite = models.Favorite.objects.create(user=user, recipe=recipe)
+            cart = models.ShoppingCart.objects.create(user=user, recipe=recipe)
+            created_at = now - step * number
+            for event in (favorite, cart):
+                type(event).objects.filter(pk=event.pk).update(
+                    created_at=created_at
+                )
+
+    def scores(self):
+        # Оценки хранятся относительно точки отсчёта, которая у полного
+        # пересчёта своя: сравниваются доли оценок
+        scores = dict(
+            models.Recipe.objects.values_list("id", "trending_score")
+        )
+        total = sum(scores.values())
+        return {pk: round(score / total, 9) for pk, score in scores.items()}
+
+    def assert_matches_full(self, now):
+        with mock.patch.object(trending.timezone, "now", return_value=now):
+            self.assertTrue(trending.update_trending())
+            incremental = self.scores()
+            trending.update_trending(full=True)
+        self.assertEqual(incremental, self.scores())
+
+    def test_new_events(self):
+        now = timezone.now()
+        self.add_events(
+            self.users[0], self.recipes[:5], now, timedelta(days=1)
+        )
+        with mock.patch.object(trending.timezone, "now", return_value=now):
+            trending.update_trending()
+        later = now + timedelta(days=2)
+        # События после прошлого запуска
+        self.add_events(
+            self.users[1], self.recipes[3:], later, timedelta(hours=1)
+        )
+        self.assert_matches_full(later)
+
+    def test_rebase(self):
+        now = timezone.now()
+        self.add_events(
+            self.users[0], self.recipes[:5], now, timedelta(days=1)
+        )
+        with mock.patch.object(trending.timezone, "now", return_value=now):
+            trending.update_trending()
+        later = now + trending.REBASE_AFTER + timedelta(days=1)
+        # События после прошлого запуска
+        self.add_events(
+            self.users[1], self.recipes[3:], later, timedelta(hours=1)
+        )
+        self.assert_matches_full(later)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageVariantsTest(RecipeData, APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def test_command_generates_missing_variants(self):
+        image_name = models.Recipe.image.field.storage.save(
+            "recipes/images/recipe.gif", ContentFile(GIF)
+        )
+        models.Recipe.objects.update(image=image_name)
+        self.assertEqual(images.pending_images(), [image_name])
+        call_command("generate_image_variants", stdout=StringIO())
+        self.assertEqual(images.pending_images(), [])
+        recipe = models.Recipe.objects.get(pk=self.recipes[0].pk)
+        self.assertTrue(images.variants_ready(recipe))
+
+        os.remove(os.path.join(MEDIA_ROOT, recipe.image_variants["webp"]))
+        self.assertEqual(images.pending_images(), [])
+        self.assertEqual(
+            images.pending_images(check_files=True), [image_name]
+        )
+        call_command(
+            "generate_image_variants", "--check-files", stdout=StringIO()
+        )
+        self.assertEqual(images.pending_images(check_files=True), [])
+
+    def test_failures_are_logged(self):
+        future = Future()
+        future.set_exception(FileNotFoundError("recipe.gif"))
+        with self.assertLogs("recipes.images", "ERROR") as logs:
+            images.log_failure("recipes/images/recipe.gif")(future)
+        self.assertIn("recipes/images/recipe.gif", logs.output[0])
+
+
+class SearchTest(RecipeData, APITestCase):
+    @skipUnless(connection.vendor == "sqlite", "FTS5 есть только в SQLite")
+    def test_sqlite_returns_all_matches_by_rank(self):
+        author = self.users[0]
+        in_text = models.Recipe.objects.create(
+            author=author, name="Суп", text="Не хуже, чем борщ",
+            image="recipes/images/recipe.gif", cooking_time=10,
+        )
+        in_name = models.Recipe.objects.create(
+            author=author, name="Борщ", text="Описание",
+            image="recipes/images/recipe.gif", cooking_time=10,
+        )
+        found = search.search_recipes(models.Recipe.objects.all(), "борщ")
+        self.assertEqual(list(found), [in_name, in_text])
+
+        # Больше совпадений, чем прежний предел выборки из FTS5
+        models.Recipe.objects.bulk_create(
+            models.Recipe(
+                author=author, name=f"Салат {i}", text="Описание",
+                image="recipes/images/recipe.gif", cooking_time=10,
+            )
+            for i in range(1100)
+        )
+        search.index_recipes(
+            models.Recipe.objects.filter(name__startswith="Салат")
+        )
+        found = search.search_recipes(models.Recipe.objects.all(), "салат")
+        self.assertEqual(found.count(), 1100)
+        self.assertEqual(found[1099:].get().name, "Салат 0")
+
+    def test_postgresql_query(self):
+        with mock.patch.object(connection, "vendor", "postgresql"):
+            found = search.search_recipes(models.Recipe.objects.all(), "борщ")
+            sql = str(found.query)
+        self.assertIn("websearch_to_tsquery", sql)
+        self.assertIn("ts_rank", sql)
+        self.assertEqual(found.query.order_by, ("-search_rank", "-id"))
@@ -0,0 +1,100 @@
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Case, F, FloatField, Value, When
+from django.utils import timezone
+
+from .models import Favorite, Recipe, ShoppingCart
+from .watermarks import get_watermark, set_watermark
+
+HALF_LIFE = timedelta(days=7)
+DECAY = math.log(2) / HALF_LIFE.total_seconds()
+# Вклад события в популярность рецепта в момент события
+WEIGHTS = ((Favorite, 1.0), (ShoppingCart, 0.5))
+# События, сохранённые незадолго до запуска, могут быть ещё не видны:
+# они обрабатываются следующим запуском
+LAG = timedelta(minutes=1)
+# Через столько времени от точки отсчёта оценки приводятся к новой точке,
+# чтобы не росли без ограничений
+REBASE_AFTER = HALF_LIFE * 100
+BATCH_SIZE = 1000
+WATERMARK = "trending"
+EPOCH = "trending_epoch"
+
+
+def _weight(created_at, epoch):
+    return math.exp(DECAY * (created_at - epoch).total_seconds())
+
+
+def _add_scores(deltas):
+    """
+    Прибавляет deltas ({id рецепта: вклад}) к trending_score одним UPDATE
+    на каждые BATCH_SIZE рецептов.
+    """
+    recipe_ids = sorted(deltas)
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        Recipe.objects.filter(pk__in=batch).update(
+            trending_score=F("trending_score")
+            + Case(
+                *(
+                    When(pk=pk, then=Value(deltas[pk]))
+                    for pk in batch
+                ),
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        )
+
+
+def _rebase(epoch, now):
+    """
+    Переносит точку отсчёта в now: все оценки умножаются на один и тот же
+    коэффициент, порядок рецептов не меняется.
+    """
+    factor = math.exp(-DECAY * (now - epoch).total_seconds())
+    Recipe.objects.update(trending_score=F("trending_score") * factor)
+    set_watermark(EPOCH, now)
+    return now
+
+
+def update_trending(full=False):
+    """
+    Добавляет к популярности рецептов события избранного и списков покупок,
+    появившиеся с прошлого запуска. Возвращает число обработанных событий.
+
+    Вклад события затухает вдвое за HALF_LIFE. Вместо пересчёта всех оценок
+    при каждом запуске вклад хранится приведённым к общей точке отсчёта
+    EPOCH: exp(DECAY * (время события - EPOCH)). Текущие оценки отличаются
+    от хранимых одним множителем для всех рецептов, поэтому сортировка по
+    trending_score совпадает с сортировкой по текущей популярности.
+
+    Удаление из избранного или списка покупок не уменьшает оценку до
+    полного пересчёта (full=True).
+    """
+    now = timezone.now()
+    until = now - LAG
+    watermark = get_watermark(WATERMARK)
+    epoch = get_watermark(EPOCH)
+    if full or watermark is None or epoch is None:
+        Recipe.objects.update(trending_score=0)
+        watermark = None
+        epoch = now
+        set_watermark(EPOCH, epoch)
+    elif now - epoch > REBASE_AFTER:
+        epoch = _rebase(epoch, now)
+
+    deltas = defaultdict(float)
+    events = 0
+    for model, weight in WEIGHTS:
+        queryset = model.objects.filter(created_at__lt=until)
+        if watermark is not None:
+            queryset = queryset.filter(created_at__gte=watermark)
+        rows = queryset.values_list("recipe_id", "created_at")
+        for recipe_id, created_at in rows.iterator(chunk_size=BATCH_SIZE):
+            deltas[recipe_id] += weight * _weight(created_at, epoch)
+            events += 1
+    _add_scores(deltas)
+    set_watermark(WATERMARK, until)
+    return events
@@ -0,0 +1,17 @@
+from .models import Watermark
+
+
+def get_watermark(name):
+    """
+    Возвращает время, до которого задача name обработала данные, или None,
+    если она ещё не запускалась.
+    """
+    return (
+        Watermark.objects.filter(name=name)
+        .values_list("value", flat=True)
+        .first()
+    )
+
+
+def set_watermark(name, value):
+    Watermark.objects.update_or_create(name=name, defaults={"value": value})